@@ -0,0 +1,152 @@
+import numpy
+import pandas
+
+# ****************************************
+# aggregation cube shared by the figures
+# ****************************************
+
+CUBE_LEVELS = ['Project', 'Country', 'Status', 'FIDStatus', 'FacilityType']
+
+
+def build_cube(terms_df, country_ratios_df):
+    '''
+    Sums every measure the figures use over
+    Project x Country x Status x FIDStatus x FacilityType, once per dataset
+    version. The figures are slices of this, never of the raw sheets.
+    Measures: count (terminals, like groupby count of TerminalID),
+    capacity (bcm/y), km and fraction (pipelines, split by country).
+    '''
+    terms_cube = pandas.DataFrame({
+        'Project': 'terminals',
+        'Country': terms_df['Country'],
+        'Status': terms_df['Status'],
+        'FIDStatus': terms_df['FIDStatus'],
+        'FacilityType': terms_df['FacilityType'],
+        'count': terms_df['TerminalID'].notna().astype(int),
+        'capacity': pandas.to_numeric(terms_df['CapacityInBcm/y'], errors='coerce'),
+    })
+    pipes_cube = pandas.DataFrame({
+        'Project': 'pipelines',
+        'Country': country_ratios_df['Country'],
+        'Status': country_ratios_df['Status'],
+        'FIDStatus': country_ratios_df['FIDStatus'],
+        'FacilityType': 'Pipeline',
+        'km': pandas.to_numeric(country_ratios_df['LengthMergedKmByCountry'], errors='coerce'),
+        'fraction': pandas.to_numeric(country_ratios_df['LengthPerCountryFraction'], errors='coerce'),
+    })
+
+    # dropna=False keeps e.g. terminals without a FIDStatus in the totals;
+    # observed=True leaves out combinations of categories that don't occur
+    cube = pandas.concat([terms_cube, pipes_cube], ignore_index=True).groupby(
+        CUBE_LEVELS, dropna=False, sort=True, observed=True).sum()
+
+    return cube
+
+def cube_sum(cube, measure, project, countries, statuses=None, fid_statuses=None, facility_types=None):
+    '''
+    Sum of a measure by country, for one project type and the given
+    statuses, FID statuses and facility types (None means all).
+    '''
+    if project not in cube.index.get_level_values('Project'):
+        return pandas.Series(dtype=float)
+    project_cube = cube.xs(project, level='Project')
+
+    mask = project_cube.index.get_level_values('Country').isin(countries)
+    if statuses is not None:
+        mask &= project_cube.index.get_level_values('Status').isin(statuses)
+    if fid_statuses is not None:
+        mask &= project_cube.index.get_level_values('FIDStatus').isin(fid_statuses)
+    if facility_types is not None:
+        mask &= project_cube.index.get_level_values('FacilityType').isin(facility_types)
+
+    return project_cube.loc[mask, measure].groupby(level='Country').sum()
+
+# ****************************************
+# counts by status and year
+# ****************************************
+
+# the year a project reached each status
+STATUS_YEAR_COLUMNS = {
+    'Cancelled': 'CancelledYear',
+    'Shelved': 'ShelvedYear',
+    'Operating': 'StartYearEarliest',
+    'Proposed': 'ProposalYear',
+    'Construction': 'ConstructionYear',
+}
+
+YEAR_COUNT_MEASURES = ['pipelines', 'pipeline km', 'terminals', 'terminal capacity']
+
+
+def status_years(df):
+    '''
+    Picks each row's year from the column that matches its status
+    (CancelledYear for cancelled projects, ...) in one indexed lookup.
+    Statuses without a year column and non-numeric years give NaN.
+    '''
+    year_columns = list(STATUS_YEAR_COLUMNS.values())
+    column_idx = df['Status'].str.capitalize().map(
+        {status: i for i, status in enumerate(STATUS_YEAR_COLUMNS)})
+
+    has_column = column_idx.notna().to_numpy()
+    years = pandas.Series(numpy.nan, index=df.index, dtype=object)
+    years[has_column] = df.loc[has_column, year_columns].to_numpy()[
+        numpy.arange(has_column.sum()), column_idx[has_column].astype(int)]
+
+    return pandas.to_numeric(years, errors='coerce')
+
+def build_year_cube(terms_df, country_ratios_df):
+    '''
+    Sums pipelines (as country fractions), pipeline km, terminals and terminal
+    capacity over Project x Country x Status x FacilityType x Year, with each
+    project counted in the year it reached its current status.
+    '''
+    pipes_long = pandas.DataFrame({
+        'Project': 'pipelines',
+        'Country': country_ratios_df['Country'],
+        'Status': country_ratios_df['Status'],
+        'FacilityType': 'Pipeline',
+        'Year': status_years(country_ratios_df),
+        'pipelines': pandas.to_numeric(country_ratios_df['LengthPerCountryFraction'], errors='coerce'),
+        'pipeline km': pandas.to_numeric(country_ratios_df['LengthMergedKmByCountry'], errors='coerce'),
+    })
+    terms_long = pandas.DataFrame({
+        'Project': 'terminals',
+        'Country': terms_df['Country'],
+        'Status': terms_df['Status'],
+        'FacilityType': terms_df['FacilityType'],
+        'Year': status_years(terms_df),
+        'terminals': terms_df['TerminalID'].notna().astype(int),
+        'terminal capacity': pandas.to_numeric(terms_df['CapacityInBcm/y'], errors='coerce'),
+    })
+    projects_long = pandas.concat([pipes_long, terms_long], ignore_index=True).dropna(subset=['Year'])
+    projects_long['Year'] = projects_long['Year'].astype(int)
+
+    return projects_long.groupby(['Project','Country','Status','FacilityType','Year'],
+                                 observed=True)[YEAR_COUNT_MEASURES].sum()
+
+def year_counts(year_cube, countries, pipeline_statuses=None, facility_types=None):
+    '''
+    Slices the year cube to the given countries, pipeline statuses and
+    terminal facility types, with one row per year from the earliest to the
+    latest year in the data. Columns are named '<Status> <measure>'.
+    '''
+    levels = year_cube.index
+
+    mask = levels.get_level_values('Country').isin(countries)
+    if pipeline_statuses is not None:
+        mask &= ((levels.get_level_values('Project')!='pipelines')|
+                 levels.get_level_values('Status').isin(pipeline_statuses))
+    if facility_types is not None:
+        mask &= ((levels.get_level_values('Project')!='terminals')|
+                 levels.get_level_values('FacilityType').isin(facility_types))
+    year_slice = year_cube.loc[mask]
+
+    statuses = year_slice.index.get_level_values('Status').str.capitalize()
+    years_sum = year_slice.groupby([year_slice.index.get_level_values('Year'), statuses]).sum().unstack()
+    years_sum.columns = [f'{status} {measure}' for measure, status in years_sum.columns]
+
+    all_years = year_cube.index.get_level_values('Year')
+    years = numpy.arange(all_years.min(), all_years.max()+1) if all_years.size else numpy.arange(0)
+    columns = [f'{status} {measure}' for status in STATUS_YEAR_COLUMNS for measure in YEAR_COUNT_MEASURES]
+
+    return years_sum.reindex(index=years, columns=columns).fillna(0)
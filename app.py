@@ -1,81 +1,75 @@
+import os
+import re
+
+import flask
 import pandas
 import numpy
-import pygsheets
 import geopandas
 import shapely
 
 import dash
 import plotly.express as px
+import plotly.graph_objects as go
 #import jupyter_dash
 import dash_bootstrap_components as dbc
 
-# ****************************************
-# import pipelines data
-# ****************************************
-
-gc = pygsheets.authorize(service_account_env_var='GDRIVE_API_CREDENTIALS')
-
-#spreadsheet = gc.open_by_key('1MX_6I2QW07lFFWMO-k3mjthBlQGFlv5aTMBmvbliYUY') # current version
-#spreadsheet = gc.open_by_key('1PKsCoVnfnCEalDBOF0Fmny0-pg1qy86DoReNHI-97WM') # Mar 2023 release
-spreadsheet = gc.open_by_key('1CktxlI1RgYUvKtL0iaNjnZszXFVjSj0JKgPnxkbm414') # Jan 2025 release
-
-gas_pipes = spreadsheet.worksheet('title', 'Gas pipelines').get_as_df(start='A3')
-oil_pipes = spreadsheet.worksheet('title', 'Oil/NGL pipelines').get_as_df(start='A3')
-
-pipes_df_orig = gas_pipes.copy()#pandas.concat([oil_pipes, gas_pipes], ignore_index=True)
-# remove empty cells for pipes, owners
-pipes_df_orig = pipes_df_orig[pipes_df_orig['PipelineName']!='']
+from aggregates import cube_sum, year_counts
+from plotly.io.json import to_json_plotly
 
-#get other relevant sheets
-country_ratios_df = spreadsheet.worksheet('title', 'Country ratios by pipeline').get_as_df()
-
-# get regional info
-region_df_orig = spreadsheet.worksheet('title', 'Country dictionary').get_as_df(start='A2')
-
-region_df_eu = region_df_orig.copy()[region_df_orig['EuropeanUnion']=='Yes']
-region_df_egt = region_df_orig.copy()[region_df_orig['EuroGasTracker']=='Yes']
-region_df_europe = region_df_orig.copy()[region_df_orig['Region']=='Europe']
-region_df_touse = region_df_eu.copy()
-
-country_list = region_df_touse.Country
+from figure_cache import FigureCache, figure_placeholder, splice_figures
+from compression import brotli, compressed_body, compress_response, compress_callback_response
+from static_assets import StaticAssets
+from basemap import TOPOJSON_DIR, basemap_asset, use_basemap, basemap_country_ids, apply_basemap
+from routes import ROUTE_LODS, route_lod, line_coordinates
+from spatial_index import NEARBY_RADIUS_KM
+from plotly_bundle import BUNDLE_ASSET, use_bundle
+from http_caching import conditional_response, tag_static_responses, LAYOUT_MAX_AGE
+from dataset import (current_dataset, load_dataset, DataRefresher, REFRESH_INTERVAL,
+                     REGIONS, DEFAULT_REGION)
 
 # ****************************************
-# import terminals
+# creating figures
 # ****************************************
 
-spreadsheet = gc.open_by_key('1fziNYGHLG1uXozfNI6MGzwyUQt6R3-30PPfug6ZqcAk') # Jan 2025 release
+def capacity_by_status(dataset, region):
+    # planned import capacity per country, shared by the bar chart and the map
 
-terms_df_orig = spreadsheet.worksheet('title', 'Terminals').get_as_df(start='A3')
+    country_list = dataset.regions[region].Country
 
-# replace all -- with nans
-terms_df_orig.replace('--', numpy.nan, inplace=True)
-# remove oil export terminals
-terms_df_orig = terms_df_orig.loc[terms_df_orig['Fuel']=='LNG']
-# remove anything without a wiki page
-terms_df_orig = terms_df_orig.loc[terms_df_orig['Wiki']!='']
-# remove anything without latlon coords
+    terms_df_capacity_sum = pandas.DataFrame(0, index=country_list, columns=['Pre-construction','Construction'])
 
+    # proposed
+    terms_df_capacity_sum['Pre-construction'] += cube_sum(dataset.cube, 'capacity', 'terminals', country_list,
+                                                          statuses=['Proposed'], facility_types=['Import'])
+    # construction
+    terms_df_capacity_sum['Construction'] += cube_sum(dataset.cube, 'capacity', 'terminals', country_list,
+                                                      statuses=['Construction'], facility_types=['Import'])
 
+    terms_df_capacity_sum.replace(numpy.nan,0,inplace=True)
 
-# ****************************************
-# creating figures
-# ****************************************
+    return(terms_df_capacity_sum)
 
-def fig_capacity():
+def length_by_status(dataset, region):
+    # km of planned pipelines per country, shared by the bar chart and the map
 
-    terms_df_capacity_sum = pandas.DataFrame(0, index=country_list, columns=['Pre-construction','Construction'])
-    terms_df_region = terms_df_orig[(terms_df_orig.Country.isin(region_df_touse.Country))&
-                                (terms_df_orig.Status.isin(['Construction','Proposed']))&
-                                (terms_df_orig['FacilityType'].isin(['Import']))]
+    country_list = dataset.regions[region].Country
+
+    pipes_df_length_sum = pandas.DataFrame(0, index=country_list, columns=['Pre-construction','Construction'])
 
     # proposed
-    terms_df_capacity_sum['Pre-construction'] += terms_df_region.loc[terms_df_region.Status=='Proposed'].groupby(
-        'Country')['CapacityInBcm/y'].sum()
+    pipes_df_length_sum['Pre-construction'] += cube_sum(dataset.cube, 'km', 'pipelines', country_list,
+                                                        statuses=['proposed'])
     # construction
-    terms_df_capacity_sum['Construction'] += terms_df_region.loc[terms_df_region.Status=='Construction'].groupby(
-        'Country')['CapacityInBcm/y'].sum()
+    pipes_df_length_sum['Construction'] += cube_sum(dataset.cube, 'km', 'pipelines', country_list,
+                                                    statuses=['construction'])
 
-    terms_df_capacity_sum.replace(numpy.nan,0,inplace=True)
+    pipes_df_length_sum.replace(numpy.nan,0,inplace=True)
+
+    return(pipes_df_length_sum)
+
+def fig_capacity(dataset, region):
+
+    terms_df_capacity_sum = capacity_by_status(dataset, region)
 
     # reorder for descending values
     country_order = terms_df_capacity_sum.sum(axis=1).sort_values(ascending=True).index
@@ -125,23 +119,9 @@ def fig_capacity():
     
     return(fig, terms_df_capacity_sum)
 
-def fig_length():
+def fig_length(dataset, region):
 
-    pipes_df_length_sum = pandas.DataFrame(0, index=country_list, columns=['Pre-construction','Construction'])
-    country_ratios_df_region = country_ratios_df[(country_ratios_df.Country.isin(region_df_touse.Country))&
-                                                 (country_ratios_df.Status.isin(['construction','proposed']))]
-    
-    country_ratios_df_region = country_ratios_df[(country_ratios_df.Country.isin(region_df_touse.Country))&
-                                (country_ratios_df.Status.isin(['construction','proposed']))]
-    
-    # proposed
-    pipes_df_length_sum['Pre-construction'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='proposed'].groupby(
-        'Country')['LengthMergedKmByCountry'].sum()
-    # construction
-    pipes_df_length_sum['Construction'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='construction'].groupby(
-        'Country')['LengthMergedKmByCountry'].sum()
-
-    pipes_df_length_sum.replace(numpy.nan,0,inplace=True)
+    pipes_df_length_sum = length_by_status(dataset, region)
 
     # reorder for descending values
     country_order = pipes_df_length_sum.sum(axis=1).sort_values(ascending=True).index
@@ -192,22 +172,24 @@ def fig_length():
     
     return(fig, pipes_df_length_sum)
 
-def fig_fid():
+def fig_fid(dataset, region):
     
-    terms_df_region = terms_df_orig[(terms_df_orig.Country.isin(region_df_touse.Country))&
-                                    (terms_df_orig.Status.isin(['Construction','Proposed']))&
-                                    (terms_df_orig['FacilityType'].isin(['Import']))]
-    country_ratios_df_region = country_ratios_df[(country_ratios_df.Country.isin(region_df_touse.Country))&
-                                (country_ratios_df.Status.isin(['construction','proposed']))]
+    country_list = dataset.regions[region].Country
 
     projects_df_fid_sum = pandas.DataFrame(0, index=country_list, columns=['Pipelines FID','Terminals FID','Pipelines pre-FID','Terminals pre-FID'])
 
     # Pipelines
-    projects_df_fid_sum['Pipelines FID'] += country_ratios_df_region[country_ratios_df_region.FIDStatus.isin(['FID'])].groupby('Country')['LengthPerCountryFraction'].sum()
-    projects_df_fid_sum['Pipelines pre-FID'] += country_ratios_df_region[country_ratios_df_region.FIDStatus.isin(['Pre-FID'])].groupby('Country')['LengthPerCountryFraction'].sum()
+    projects_df_fid_sum['Pipelines FID'] += cube_sum(dataset.cube, 'fraction', 'pipelines', country_list,
+                                                     statuses=['construction','proposed'], fid_statuses=['FID'])
+    projects_df_fid_sum['Pipelines pre-FID'] += cube_sum(dataset.cube, 'fraction', 'pipelines', country_list,
+                                                         statuses=['construction','proposed'], fid_statuses=['Pre-FID'])
     # Terminals
-    projects_df_fid_sum['Terminals FID'] += terms_df_region.loc[terms_df_region.FIDStatus.isin(['FID'])].groupby('Country')['TerminalID'].count()
-    projects_df_fid_sum['Terminals pre-FID'] += terms_df_region.loc[terms_df_region.FIDStatus.isin(['Pre-FID'])].groupby('Country')['TerminalID'].count()
+    projects_df_fid_sum['Terminals FID'] += cube_sum(dataset.cube, 'count', 'terminals', country_list,
+                                                     statuses=['Construction','Proposed'], fid_statuses=['FID'],
+                                                     facility_types=['Import'])
+    projects_df_fid_sum['Terminals pre-FID'] += cube_sum(dataset.cube, 'count', 'terminals', country_list,
+                                                         statuses=['Construction','Proposed'], fid_statuses=['Pre-FID'],
+                                                         facility_types=['Import'])
 
     projects_df_fid_sum.replace(numpy.nan,0,inplace=True)
 
@@ -271,69 +253,15 @@ def fig_fid():
 
     return(fig, projects_df_fid_sum)
 
-def fig_year_counts():
+def fig_year_counts(dataset, region):
     
-    terms_df_region = terms_df_orig[(terms_df_orig.Country.isin(region_df_touse.Country))&
-                                    (terms_df_orig['FacilityType'].isin(['Import']))]
-    country_ratios_df_region = country_ratios_df[(country_ratios_df.Country.isin(region_df_touse.Country))&
-                                (country_ratios_df.Status.isin(['cancelled','operating']))]
-
-    projects_df_years_sum = pandas.DataFrame(0, index=numpy.arange(1850,2025), columns=['Cancelled pipelines',
-                                                                                 'Cancelled pipeline km',
-                                                                                 'Cancelled terminals',
-                                                                                 'Cancelled terminal capacity',
-                                                                                 'Operating pipelines',
-                                                                                 'Operating pipeline km',
-                                                                                 'Operating terminals',
-                                                                                 'Operating terminal capacity',
-                                                                                 'Shelved pipelines',
-                                                                                 'Shelved pipeline km',
-                                                                                 'Shelved terminals',
-                                                                                 'Shelved terminal capacity',
-                                                                                 'Proposed pipelines',
-                                                                                 'Proposed pipeline km',
-                                                                                 'Proposed terminals',
-                                                                                 'Proposed terminal capacity',
-                                                                                 'Construction pipelines',
-                                                                                 'Construction pipeline km',
-                                                                                 'Construction terminals',
-                                                                                 'Construction terminal capacity',
-                                                                                       ])
-
-    # Pipelines
-    projects_df_years_sum['Cancelled pipelines'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='cancelled'].groupby('CancelledYear')['LengthPerCountryFraction'].sum()
-    projects_df_years_sum['Cancelled pipeline km'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='cancelled'].groupby('CancelledYear')['LengthMergedKmByCountry'].sum()
-    # Terminals
-    projects_df_years_sum['Cancelled terminals'] += terms_df_region.loc[terms_df_region.Status=='Cancelled'].groupby('CancelledYear')['TerminalID'].count()
-    projects_df_years_sum['Cancelled terminal capacity'] += terms_df_region.loc[terms_df_region.Status=='Cancelled'].groupby('CancelledYear')['CapacityInBcm/y'].count()
+    # one row per year in the data, '<Status> pipelines', '<Status> terminals', ... columns
+    projects_df_years_sum = year_counts(dataset.year_cube, dataset.regions[region].Country,
+                                        pipeline_statuses=['cancelled','operating'],
+                                        facility_types=['Import'])
 
-    # Pipelines
-    projects_df_years_sum['Operating pipelines'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='operating'].groupby('StartYearEarliest')['LengthPerCountryFraction'].sum()
-    projects_df_years_sum['Operating pipeline km'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='operating'].groupby('StartYearEarliest')['LengthMergedKmByCountry'].sum()
-    # Terminals
-    projects_df_years_sum['Operating terminals'] += terms_df_region.loc[terms_df_region.Status=='Operating'].groupby('StartYearEarliest')['TerminalID'].count()
-    projects_df_years_sum['Operating terminal capacity'] += terms_df_region.loc[terms_df_region.Status=='Operating'].groupby('StartYearEarliest')['CapacityInBcm/y'].count()
-
-    # Pipelines
-    projects_df_years_sum['Shelved pipelines'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='shelved'].groupby('ShelvedYear')['LengthPerCountryFraction'].sum()
-    projects_df_years_sum['Shelved pipeline km'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='shelved'].groupby('ShelvedYear')['LengthMergedKmByCountry'].sum()
-    # Terminals
-    projects_df_years_sum['Shelved terminals'] += terms_df_region.loc[terms_df_region.Status=='Shelved'].groupby('ShelvedYear')['TerminalID'].count()
-    projects_df_years_sum['Shelved terminal capacity'] += terms_df_region.loc[terms_df_region.Status=='Shelved'].groupby('ShelvedYear')['CapacityInBcm/y'].count()
-
-    # Pipelines
-    projects_df_years_sum['Proposed pipelines'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='proposed'].groupby('ProposalYear')['LengthPerCountryFraction'].sum()
-    projects_df_years_sum['Proposed pipeline km'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='proposed'].groupby('ProposalYear')['LengthMergedKmByCountry'].sum()
-    # Terminals
-    projects_df_years_sum['Proposed terminals'] += terms_df_region.loc[terms_df_region.Status=='Proposed'].groupby('ProposalYear')['TerminalID'].count()
-    projects_df_years_sum['Proposed terminal capacity'] += terms_df_region.loc[terms_df_region.Status=='Proposed'].groupby('ProposalYear')['CapacityInBcm/y'].count()
-
-    # Pipelines
-    projects_df_years_sum['Construction pipelines'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='construction'].groupby('ConstructionYear')['LengthPerCountryFraction'].sum()
-    projects_df_years_sum['Construction pipeline km'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='construction'].groupby('ConstructionYear')['LengthMergedKmByCountry'].sum()
-    # Terminals
-    projects_df_years_sum['Construction terminals'] += terms_df_region.loc[terms_df_region.Status=='Construction'].groupby('ConstructionYear')['TerminalID'].count()
-    projects_df_years_sum['Construction terminal capacity'] += terms_df_region.loc[terms_df_region.Status=='Construction'].groupby('ConstructionYear')['CapacityInBcm/y'].count()
+    # show the latest 14 years
+    last_year = projects_df_years_sum.index.max() if projects_df_years_sum.index.size else pandas.Timestamp.now().year
 
     # ****************************************
 
@@ -388,7 +316,7 @@ def fig_year_counts():
         xaxis={'mirror':'allticks','side':'top'},
         title_y=.97,
         title_yanchor='top',
-        xaxis_range=[2011.5,2025.5],
+        xaxis_range=[last_year-13.5,last_year+.5],
         title={'x':0.5, 'xanchor': 'center'},
         yaxis=dict(tickmode='linear',
                    tick0=0,
@@ -408,29 +336,77 @@ def fig_year_counts():
     
     return(fig, projects_df_years_sum)
 
-def fig_capacity_map():
-
-    terms_df_capacity_sum = pandas.DataFrame(0, index=country_list, columns=['Pre-construction','Construction'])
-    terms_df_region = terms_df_orig[(terms_df_orig.Country.isin(region_df_touse.Country))&
-                                    (terms_df_orig.Status.isin(['Construction','Proposed']))&
-                                    (terms_df_orig['FacilityType'].isin(['Import']))]
-
-    # proposed
-    terms_df_capacity_sum['Pre-construction'] += terms_df_region.loc[terms_df_region.Status=='Proposed'].groupby(
-        'Country')['CapacityInBcm/y'].sum()
-    # construction
-    terms_df_capacity_sum['Construction'] += terms_df_region.loc[terms_df_region.Status=='Construction'].groupby(
-        'Country')['CapacityInBcm/y'].sum()
-
-    terms_df_capacity_sum.replace(numpy.nan,0,inplace=True)
+# marker and route colours by status, in the shades of the status bars
+STATUS_COLORS = {
+    'operating': px.colors.sample_colorscale('oranges', 0.9)[0],
+    'construction': px.colors.sample_colorscale('purples', 0.9)[0],
+    'proposed': px.colors.sample_colorscale('blues', 0.9)[0],
+    'shelved': px.colors.sample_colorscale('greys', 0.5)[0],
+    'cancelled': px.colors.sample_colorscale('greys', 0.9)[0],
+    'idle': px.colors.sample_colorscale('greys', 0.3)[0],
+    'mothballed': px.colors.sample_colorscale('greys', 0.3)[0],
+}
+# for any other status
+OTHER_STATUS_COLOR = px.colors.sample_colorscale('greys', 0.7)[0]
+
+# largest terminal marker, for the largest capacity (px)
+TERMINAL_MAX_SIZE = 25
+
+def add_terminal_layer(fig, dataset, region):
+    '''
+    Draws the region's planned import terminals (proposed or under
+    construction, like capacity_by_status counts) on a map, one scattergeo
+    trace per status with markers sized by CapacityInBcm/y, straight from
+    the location and capacity arrays.
+    '''
+    terms_gdf = dataset.terms_gdf
+    country_list = dataset.regions[region].Country
+
+    in_region = (terms_gdf['Country'].isin(country_list) & terms_gdf['Longitude'].notna() &
+                 (terms_gdf['FacilityType']=='Import')).to_numpy()
+    statuses = terms_gdf['Status'].str.lower().to_numpy()
+    # unknown capacities count as 0, as in the country sums, and get the
+    # smallest marker
+    capacity = pandas.to_numeric(terms_gdf['CapacityInBcm/y'], errors='coerce').to_numpy(dtype=float, na_value=0)
+    lon = terms_gdf['Longitude'].to_numpy()
+    lat = terms_gdf['Latitude'].to_numpy()
+    names = terms_gdf['TerminalName'].to_numpy()
+
+    # marker area proportional to capacity, the same scale for every status
+    sizeref = 2*max(capacity[in_region].max(initial=0), 1)/TERMINAL_MAX_SIZE**2
+
+    for status in ['proposed', 'construction']:
+        color = STATUS_COLORS[status]
+        mask = in_region & (statuses==status)
+        if not mask.any():
+            continue
+        fig.add_scattergeo(lon=lon[mask], lat=lat[mask], text=names[mask],
+                           customdata=capacity[mask],
+                           mode='markers',
+                           marker=dict(size=capacity[mask], sizemode='area', sizeref=sizeref, sizemin=3,
+                                       color=color, opacity=0.8, line=dict(width=0.5, color='white')),
+                           name=status.capitalize(),
+                           hovertemplate='%{text}<br>%{customdata} bcm/y<extra>'+status.capitalize()+'</extra>')
+
+    return fig
+
+def local_basemap(fig):
+    # draws a map's countries from the local Europe basemap, if it was built
+    if use_basemap(app.config.assets_folder):
+        apply_basemap(fig, static_assets.asset_url(basemap_asset()),
+                      basemap_country_ids(app.config.assets_folder),
+                      landcolor=fig.layout.geo.landcolor, oceancolor=fig.layout.geo.oceancolor)
+    return fig
+
+def fig_capacity_map(dataset, region):
+
+    terms_df_capacity_sum = capacity_by_status(dataset, region)
 
     # create cloropleth info
     terms_df_capacity_sum['Capacity (bcm/y)'] = terms_df_capacity_sum.sum(axis=1)
 
     # add ISO Code for interaction with nat earth data
-    terms_df_capacity_sum['ISOCode'] = ''
-    for idx,row in terms_df_capacity_sum.iterrows():
-        terms_df_capacity_sum.loc[idx,'ISOCode'] = region_df_orig.loc[region_df_orig['Country']==row.name,'CountryISO3166-1alpha-3'].values[0]
+    terms_df_capacity_sum['ISOCode'] = terms_df_capacity_sum.index.map(dataset.country_iso_codes)
 
     # reorder for descending values
     country_order = terms_df_capacity_sum.sort_values(by='Capacity (bcm/y)', ascending=True).index #terms_df_capacity_sum.sum(axis=1).sort_values(ascending=True).index
@@ -482,26 +458,17 @@ def fig_capacity_map():
         colorbar=dict(thickness=15, title={'side':'right'}))
     fig.update_traces(
         selector=dict(type='choropleth'))
-    
-    return(fig)
 
-def fig_kilometers_map():
+    add_terminal_layer(fig, dataset, region)
+    fig.update_layout(legend=dict(yanchor='top', y=0.99, xanchor='left', x=0.01))
 
-    pipes_df_length_sum = pandas.DataFrame(0, index=country_list, columns=['Pre-construction','Construction'])
-    country_ratios_df_region = country_ratios_df[(country_ratios_df.Country.isin(region_df_touse.Country))&
-                                                 (country_ratios_df.Status.isin(['construction','proposed']))]
-
-    country_ratios_df_region = country_ratios_df[(country_ratios_df.Country.isin(region_df_touse.Country))&
-                                (country_ratios_df.Status.isin(['construction','proposed']))]
+    local_basemap(fig)
+    
+    return(fig)
 
-    # proposed
-    pipes_df_length_sum['Pre-construction'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='proposed'].groupby(
-        'Country')['LengthMergedKmByCountry'].sum()
-    # construction
-    pipes_df_length_sum['Construction'] += country_ratios_df_region.loc[country_ratios_df_region.Status=='construction'].groupby(
-        'Country')['LengthMergedKmByCountry'].sum()
+def fig_kilometers_map(dataset, region):
 
-    pipes_df_length_sum.replace(numpy.nan,0,inplace=True)
+    pipes_df_length_sum = length_by_status(dataset, region)
 
     # reorder for descending values
     #country_order = pipes_df_length_sum.sum(axis=1).sort_values(ascending=True).index
@@ -511,9 +478,7 @@ def fig_kilometers_map():
     pipes_df_length_sum['Pipelines (km)'] = pipes_df_length_sum.sum(axis=1)
 
     # add ISO Code for interaction with nat earth data
-    pipes_df_length_sum['ISOCode'] = ''
-    for idx,row in  pipes_df_length_sum.iterrows():
-         pipes_df_length_sum.loc[idx,'ISOCode'] = region_df_orig.loc[region_df_orig['Country']==row.name,'CountryISO3166-1alpha-3'].values[0]
+    pipes_df_length_sum['ISOCode'] = pipes_df_length_sum.index.map(dataset.country_iso_codes)
 
     # reorder for descending values
     country_order =  pipes_df_length_sum.sort_values(by='Pipelines (km)', ascending=True).index #pipes_df_length_sum.sum(axis=1).sort_values(ascending=True).index
@@ -568,18 +533,99 @@ def fig_kilometers_map():
     #    selector=dict(type='choropleth'),
     #    hovertemplate='{Country}<br>{Capacity (bcm/y)} bcm/y'
     #)
+
+    local_basemap(fig)
     
     return(fig)
 
+# geo projection scale of the whole-Europe view of the maps
+MAP_SCALE = 5.5
+
+def fig_pipeline_map(dataset, region, lod=0):
+
+    country_list = dataset.regions[region].Country
+
+    # pipelines through any of the region's countries
+    ratios_df = dataset.country_ratios_df
+    region_projects = ratios_df.loc[ratios_df['Country'].isin(country_list), 'ProjectID']
+    pipes_gdf = dataset.pipes_gdf
+    in_region = pipes_gdf['ProjectID'].isin(region_projects).to_numpy()
+    statuses = pipes_gdf['Status'].str.lower().to_numpy()
+
+    # one trace per status with every route in it, separated by gaps;
+    # statuses without a colour of their own (like 'retired') come last
+    other_statuses = sorted({status for status in statuses[in_region] if isinstance(status, str)}
+                            - set(STATUS_COLORS))
+    fig = go.Figure()
+    for status in list(STATUS_COLORS) + other_statuses:
+        color = STATUS_COLORS.get(status, OTHER_STATUS_COLOR)
+        mask = in_region & (statuses==status)
+        if not mask.any():
+            continue
+        lon, lat, text = line_coordinates(dataset.route_lods[lod][mask],
+                                          pipes_gdf['PipelineName'].to_numpy()[mask])
+        fig.add_scattergeo(lon=lon, lat=lat, text=text,
+                           mode='lines',
+                           line=dict(color=color, width=1.5),
+                           name=status.capitalize(),
+                           hovertemplate='%{text}<extra>'+status.capitalize()+'</extra>')
+
+    note = 'Routes of gas pipelines'
+    fig.add_annotation(x=0.5, y=1.1,
+                       xref='paper',
+                       yref='paper',
+                       text=note,
+                       showarrow=False,
+                       align='center',
+                       font=dict(size=16))
+
+    fig.update_geos(
+        resolution=50,
+        showcoastlines=False,
+        landcolor=px.colors.sample_colorscale('greys', 1e-5)[0],
+
+        showocean=True,
+        oceancolor=px.colors.sample_colorscale('blues', 0.05)[0],
+
+        projection_type='azimuthal equal area',
+        center=dict(lat=50, lon=7),
+        projection_rotation=dict(lon=30),
+        projection_scale=MAP_SCALE)
+
+    fig.update_layout(
+        font_family='Helvetica',
+        font_color=px.colors.sample_colorscale('greys', 0.5)[0],
+        plot_bgcolor='white',
+        paper_bgcolor='white',
+
+        # zoom and pan; the view survives the figure being swapped for
+        # another level of detail
+        dragmode='pan',
+        uirevision='pipeline_map',
+        legend=dict(yanchor='top', y=0.99, xanchor='left', x=0.01),
+
+        margin=dict(l=0, r=0),)
+
+    local_basemap(fig)
+
+    return(fig)
+
 # ****************************************
 # dashboard details with tab
 # ****************************************
 
+# the bootstrap theme comes from a versioned CDN url, which is already
+# cached for a year
 external_stylesheets = [dbc.themes.BOOTSTRAP,
                         #'assets/typography.css'
                        ]
 app = dash.Dash(__name__, 
                 external_stylesheets=external_stylesheets,
+                # the figures of a tab only exist once render_tab sent it
+                suppress_callback_exceptions=True,
+                # the assets folder css and the plotly.js bundle are linked
+                # under fingerprinted names below
+                assets_ignore=rf'.*\.css$|^{re.escape(BUNDLE_ASSET)}$',
                #meta_tags=[
                #    {"name": "viewport", "content": "width=device-width, initial-scale=1"},
                #],
@@ -587,115 +633,281 @@ app = dash.Dash(__name__,
 app.title = "Europe Gas Tracker dashboard"
 server = app.server
 
+static_assets = StaticAssets(app)
+for path in static_assets.stylesheets():
+    external_stylesheets.append(static_assets.asset_url(path))
+# ahead of the dash scripts, so dcc.Graph finds it as window.Plotly and
+# doesn't load the full plotly.js
+if use_bundle(app.config.assets_folder):
+    app.config.external_scripts.append(static_assets.asset_url(BUNDLE_ASSET))
+
 # ******************************
 # create graphs of charts
-# use dcc.Graph to create these
-
-capacity_figure = dash.dcc.Graph(id='fig_capacity_id', 
-                                 config={'displayModeBar':False},
-                                 figure=fig_capacity()[0],
-                                 className='h-100')
-length_figure = dash.dcc.Graph(id='fig_length_id', 
-                               config={'displayModeBar':False},
-                               figure=fig_length()[0],
-                               className='h-100')
-fid_figure = dash.dcc.Graph(id='fig_fid_id', 
-                               config={'displayModeBar':False},
-                               figure=fig_fid()[0],
-                            className='h-100')
-year_counts_figure = dash.dcc.Graph(id='fig_year_counts_id',
-                              config={'displayModeBar':False},
-                              figure=fig_year_counts()[0],
-                                    className='h-100')
-map_capacity_figure = dash.dcc.Graph(id='fig_capacity_map_id',
-                                     config={'displayModeBar':False},
-                                     figure=fig_capacity_map(),
-                                     className='h-100')
-map_kilometers_figure = dash.dcc.Graph(id='fig_kilometers_map_id',
-                                     config={'displayModeBar':False},
-                                     figure=fig_kilometers_map(),
-                                       className='h-100')
+
+figure_cache = FigureCache()
+
+# figure id -> function building it for a dataset and region
+FIGURES = {
+    'fig_capacity_id': lambda dataset, region: fig_capacity(dataset, region)[0],
+    'fig_length_id': lambda dataset, region: fig_length(dataset, region)[0],
+    'fig_fid_id': lambda dataset, region: fig_fid(dataset, region)[0],
+    'fig_year_counts_id': lambda dataset, region: fig_year_counts(dataset, region)[0],
+    'fig_capacity_map_id': fig_capacity_map,
+    'fig_kilometers_map_id': fig_kilometers_map,
+    'fig_pipeline_map_id': fig_pipeline_map,
+}
+
+def pipeline_map_id(lod):
+    # the pipeline map at a level of detail, a figure of its own in the cache
+    return 'fig_pipeline_map_id' if lod == 0 else f'fig_pipeline_map_id-lod{lod}'
+
+for lod in range(1, len(ROUTE_LODS)):
+    FIGURES[pipeline_map_id(lod)] = lambda dataset, region, lod=lod: fig_pipeline_map(dataset, region, lod)
+
+def figure_json(dataset, region, figure_id):
+    # the figure's JSON bytes, built the first time any request needs them
+    return figure_cache.get_or_build(figure_id, region, dataset.version,
+                                     lambda: FIGURES[figure_id](dataset, region))
+
+def cached_figure(dataset, region, figure_id):
+    '''
+    Builds a figure the first time any request needs it and keeps its JSON
+    in the figure cache. Returns a placeholder to put in the dcc.Graph; the
+    cached bytes are spliced into the response (see splice_responses).
+    '''
+    figure_json(dataset, region, figure_id)
+
+    return figure_placeholder(figure_id, region, dataset.version)
+
+def rebuild_figure(figure_id, region):
+    # for a placeholder whose version was evicted before it was spliced: the
+    # current version's figure is sent in its place
+    return figure_json(current_dataset(), region, figure_id)
 
 # ******************************
 # define layout
 
-# create first tab
-tab1_content = dbc.Container(fluid=True, 
-                             children=[
-                                 dbc.Row([
-                                     dbc.Col(map_capacity_figure, 
-                                             align='start', 
-                                             lg=6, 
-                                             md=12),
-                                 ], 
-                                     justify='center'),
-                                 dbc.Row([
-                                     dbc.Col(capacity_figure, 
-                                             align='start', 
-                                             lg=5, 
-                                             md=12,
-                                             style={'height':'800px'}),
-                                 ], 
-                                     justify='center'),
-                             ])
-
-# create second tab
-tab2_content = dbc.Container(fluid=True, 
-                             children=[
-                                 dbc.Row([
-                                     dbc.Col(map_kilometers_figure, 
-                                             align='start', 
-                                             lg=6, 
-                                             md=12),
-                                 ], 
-                                     justify='center'),
-                                 dbc.Row([
-                                     dbc.Col(length_figure, 
-                                             align='start', 
-                                             lg=5, 
-                                             md=12,
-                                             style={'height':'800px'}),
-                                 ], 
-                                     justify='center'),
-                             ])
-
-# create third tab
-tab3_content = dbc.Container(fluid=True, 
-                             children=[
-                                 dbc.Row([
-                                     dbc.Col(fid_figure, 
-                                             align='start', 
-                                             lg=6, 
-                                             md=12,
-                                             style={'height':'100%'}),
-                                     dbc.Col(year_counts_figure, 
-                                             align='start', 
-                                             lg=6, 
-                                             md=12,
-                                             style={'height':'100%'})
-                                 ], style={'height':'800px'})
-                             ])
-
-# put all the tabs together
-tabs = dbc.Tabs([
-    dbc.Tab(tab1_content, label="LNG terminals",
-            label_style={"color": "#002b36"},
-            active_label_style={"color": "#839496"}),
-    dbc.Tab(tab2_content, label="Methane gas pipelines",
-            label_style={"color": "#002b36"},
-            active_label_style={"color": "#839496"}),
-    dbc.Tab(tab3_content, label="FID and status changes",
-            label_style={"color": "#002b36"},
-            active_label_style={"color": "#839496"}),
-])
-
-# fluid=True means it will fill horiz space and resize
-# https://dash-bootstrap-components.opensource.faculty.ai/docs/components/layout/
-app.layout = dbc.Container([
-    tabs,
-],
-    fluid=True)
+# tab id -> label
+TABS = {
+    'terminals': "LNG terminals",
+    'pipelines': "Methane gas pipelines",
+    'fid': "FID and status changes",
+    'routes': "Pipeline map",
+}
+DEFAULT_TAB = 'terminals'
+
+def graph_config():
+    config = {'displayModeBar':False}
+    if use_basemap(app.config.assets_folder):
+        config['topojsonURL'] = app.get_asset_url(TOPOJSON_DIR)
+    return config
+
+# tab id -> rows of cells: a graph of a figure, or a Div listing the projects
+# near a click, each with its bootstrap column width on large screens (the
+# full width below) and optionally a height and graph config. tab_content
+# lays the tabs out from it, and export_static the static copy.
+TAB_GRID = {
+    'terminals': [
+        [{'figure_id': 'fig_capacity_map_id', 'lg': 6}],
+        [{'div_id': 'capacity_map_nearby', 'lg': 6}],
+        [{'figure_id': 'fig_capacity_id', 'lg': 5, 'height': '800px'}],
+    ],
+    'pipelines': [
+        [{'figure_id': 'fig_kilometers_map_id', 'lg': 6}],
+        [{'figure_id': 'fig_length_id', 'lg': 5, 'height': '800px'}],
+    ],
+    'fid': [
+        [{'figure_id': 'fig_fid_id', 'lg': 6, 'height': '800px'},
+         {'figure_id': 'fig_year_counts_id', 'lg': 6, 'height': '800px'}],
+    ],
+    'routes': [
+        [{'figure_id': 'fig_pipeline_map_id', 'lg': 10, 'height': '700px', 'config': {'scrollZoom': True}}],
+        [{'div_id': 'pipeline_map_nearby', 'lg': 10}],
+    ],
+}
+
+def tab_content(tab, dataset, region):
+
+    # use dcc.Graph to create these
+    def cell(lg, figure_id=None, div_id=None, height=None, config=None):
+        if figure_id is not None:
+            content = dash.dcc.Graph(id=figure_id,
+                                     config={**graph_config(), **(config or {})},
+                                     figure=cached_figure(dataset, region, figure_id),
+                                     className='h-100')
+        else:
+            content = dash.html.Div(id=div_id)
+        return dbc.Col(content, align='start', lg=lg, md=12, style={'height': height} if height else None)
+
+    children = [dbc.Row([cell(**cell_args) for cell_args in row], justify='center') for row in TAB_GRID[tab]]
+    if tab == 'routes':
+        # level of detail the map is showing
+        children.append(dash.dcc.Store(id='pipeline_map_lod', data=0))
+
+    return dbc.Container(fluid=True, children=children)
+
+def serve_layout(dataset=None):
+
+    # one dataset for the whole response, even if a refresh swaps in a new one
+    dataset = dataset or current_dataset()
+
+    # choose which countries the figures cover
+    region_select = dbc.Select(id='region_select',
+                               options=[{'label': label, 'value': region}
+                                        for region, (label, _, _) in REGIONS.items()],
+                               value=DEFAULT_REGION,
+                               style={'maxWidth':'300px'},
+                               className='my-2')
+
+    # put all the tabs together; only the active tab's content is sent, the
+    # others are rendered by render_tab when they are opened
+    tabs = dbc.Tabs([
+        dbc.Tab(label=label, tab_id=tab,
+                label_style={"color": "#002b36"},
+                active_label_style={"color": "#839496"})
+        for tab, label in TABS.items()
+    ],
+        id='tabs',
+        active_tab=DEFAULT_TAB)
+
+    # fluid=True means it will fill horiz space and resize
+    # https://dash-bootstrap-components.opensource.faculty.ai/docs/components/layout/
+    return dbc.Container([
+        region_select,
+        tabs,
+        dash.html.Div(tab_content(DEFAULT_TAB, dataset, DEFAULT_REGION), id='tab_content'),
+    ],
+        fluid=True)
+
+def warm_up(dataset):
+    # a new dataset version is published with what the first page load needs
+    # (the layout and the default tab's figures) already built; every other
+    # tab and region is built the first time someone opens it
+    figure_cache.put('layout', DEFAULT_REGION, dataset.version, layout_json(dataset, build=True))
+    for encoding in ['br', 'gzip'] if brotli is not None else ['gzip']:
+        compressed_body(layout_json(dataset), encoding, figure_cache, 'layout', dataset.version)
+
+def layout_json(dataset, build=False):
+    # the layout with the cached figure bytes spliced in, built once per version
+    if not build:
+        return figure_cache.get_or_build('layout', DEFAULT_REGION, dataset.version,
+                                         lambda: layout_json(dataset, build=True))
+
+    return splice_figures(to_json_plotly(serve_layout(dataset)).encode(), figure_cache, rebuild_figure)
+
+# python static_assets.py only needs the app's assets and component
+# bundles, not the data (nor the credentials and network to get it)
+if os.environ.get('LOAD_DATASET', '1') != '0':
+    load_dataset(warm_up)
+
+# a function, so every page load gets the current dataset's figures
+app.layout = serve_layout
+
+refresher = None
+
+def start_refresher():
+    global refresher
+    if REFRESH_INTERVAL > 0 and refresher is None:
+        refresher = DataRefresher(warm_up)
+        refresher.start()
+
+# a preloading gunicorn master starts it in each worker instead (gunicorn.conf.py)
+if not os.environ.get('GUNICORN_PRELOAD'):
+    start_refresher()
+
+@server.before_request
+def serve_fingerprinted_assets():
+    return static_assets.serve_asset()
+
+@server.after_request
+def tag_component_suites(response):
+    return static_assets.tag_component_suite(response)
+
+@server.before_request
+def serve_cached_layout():
+    # answers _dash-layout from the cache instead of having dash re-encode
+    # every figure per request; it only changes with the dataset version, so
+    # a browser or proxy holding that version gets a 304
+    if flask.request.path == app.config.routes_pathname_prefix+'_dash-layout':
+        dataset = current_dataset()
+        response = flask.Response(layout_json(dataset), mimetype='application/json')
+        response = compress_response(response, figure_cache, 'layout', dataset.version)
+        return conditional_response(response, f'{dataset.version}-{DEFAULT_REGION}', LAYOUT_MAX_AGE)
+
+@server.after_request
+def splice_responses(response):
+    # callbacks return figure placeholders; swap in the cached figure JSON,
+    # compressed once per tab, region and version
+    if flask.request.path == app.config.routes_pathname_prefix+'_dash-update-component':
+        unspliced_body = response.get_data()
+        response.set_data(splice_figures(unspliced_body, figure_cache, rebuild_figure))
+        response = compress_callback_response(response, unspliced_body, figure_cache)
+    return response
+
+@server.after_request
+def tag_pages(response):
+    pages = [app.config.requests_pathname_prefix, app.config.routes_pathname_prefix+'_dash-dependencies']
+    if flask.request.path in pages:
+        response = compress_response(response, figure_cache)
+    return tag_static_responses(response, pages)
+
+@app.callback(dash.Output('tab_content', 'children'),
+              dash.Input('tabs', 'active_tab'),
+              dash.Input('region_select', 'value'),
+              prevent_initial_call=True)
+def render_tab(tab, region):
+    return tab_content(tab, current_dataset(), region)
+
+@app.callback(dash.Output('fig_pipeline_map_id', 'figure'),
+              dash.Output('pipeline_map_lod', 'data'),
+              dash.Input('fig_pipeline_map_id', 'relayoutData'),
+              dash.State('pipeline_map_lod', 'data'),
+              dash.State('region_select', 'value'),
+              prevent_initial_call=True)
+def update_pipeline_map_lod(relayout_data, lod, region):
+    # swaps in simpler or finer routes when a zoom crosses a level of detail
+    scale = (relayout_data or {}).get('geo.projection.scale')
+    if scale is None or route_lod(scale/MAP_SCALE) == lod:
+        return dash.no_update, dash.no_update
+
+    lod = route_lod(scale/MAP_SCALE)
+    return cached_figure(current_dataset(), region, pipeline_map_id(lod)), lod
+
+def nearby_projects(click_data):
+    '''
+    The nearest pipeline and the terminals around the point clicked on a
+    map. Only markers and routes report where they were clicked.
+    '''
+    points = (click_data or {}).get('points') or [{}]
+    point = points[0]
+    if 'lon' not in point or 'lat' not in point:
+        return dash.no_update
+
+    project_index = current_dataset().project_index
+    pipeline = project_index.nearest_pipeline(point['lon'], point['lat'])
+    terminals = project_index.terminals_within(point['lon'], point['lat'])
+
+    lines = [f"Nearest pipeline: {pipeline['name']} ({pipeline['status']}, {pipeline['km']:.0f} km)"
+             if pipeline is not None else f'No pipeline within {NEARBY_RADIUS_KM:.0f} km']
+    lines += [f"{terminal['name']} ({terminal['status']}, {terminal['km']:.0f} km)"
+              for terminal in terminals]
+
+    return dash.html.Div([
+        dash.html.P(f"Near {point['lat']:.2f}, {point['lon']:.2f}", className='fw-bold mb-1'),
+        dash.html.Ul([dash.html.Li(line) for line in lines]),
+    ], className='small')
+
+@app.callback(dash.Output('capacity_map_nearby', 'children'),
+              dash.Input('fig_capacity_map_id', 'clickData'),
+              prevent_initial_call=True)
+def show_capacity_map_nearby(click_data):
+    return nearby_projects(click_data)
+
+@app.callback(dash.Output('pipeline_map_nearby', 'children'),
+              dash.Input('fig_pipeline_map_id', 'clickData'),
+              prevent_initial_call=True)
+def show_pipeline_map_nearby(click_data):
+    return nearby_projects(click_data)
 
 if __name__ == '__main__':
     app.run_server()
-
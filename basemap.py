@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+
+import numpy
+import geopandas
+import shapely
+
+# ****************************************
+# local Europe basemap
+# ****************************************
+# Instead of plotly's world topojson (fetched from a CDN and projected in
+# full by the browser), the maps can draw the countries from a Europe-only
+# GeoJSON served from our assets. Build it with
+#
+#     python basemap.py [countries file or url]
+#
+# from Natural Earth admin 0 countries (by default the 1:50m ones, the same
+# detail as resolution=50) and commit what it writes to assets/basemap. While
+# those files exist and BASEMAP isn't 0, the maps use them.
+
+NATURAL_EARTH_URL = 'https://naciscdn.org/naturalearth/50m/cultural/ne_50m_admin_0_countries.zip'
+
+BASEMAP = os.environ.get('BASEMAP', '1') != '0'
+
+# level of detail -> (simplification tolerance, coordinate grid) in degrees
+BASEMAP_LEVELS = {
+    'low': (0.1, 0.01),
+    'medium': (0.03, 0.001),
+    'high': (0.01, 0.0001),
+}
+BASEMAP_DETAIL = os.environ.get('BASEMAP_DETAIL', 'medium')
+
+# everything the maps can show, with some margin (lon, lat)
+EUROPE_BOUNDS = (-32, 27, 60, 75)
+
+# Natural Earth gives -99 as ISO code for a few countries
+ISO_CODE_FIXES = {'France': 'FRA', 'Norway': 'NOR', 'Kosovo': 'XKX'}
+
+# plotly.js loads a topojson for every geo subplot with choropleths even if
+# it draws none of its layers; these empty ones are served in its place, from
+# the topojsonURL of the graphs' config
+TOPOJSON_DIR = 'basemap/topojson/'
+TOPOJSON_NAMES = ['world_50m', 'world_110m']
+TOPOJSON_LAYERS = ['land', 'ocean', 'lakes', 'rivers', 'countries', 'coastlines', 'subunits']
+
+
+def basemap_asset(detail=BASEMAP_DETAIL):
+    # path in the assets folder
+    return f'basemap/europe-{detail}.geojson'
+
+def use_basemap(assets_folder, detail=BASEMAP_DETAIL):
+    return BASEMAP and os.path.exists(os.path.join(assets_folder, basemap_asset(detail)))
+
+_country_ids = {}
+
+def basemap_country_ids(assets_folder, detail=BASEMAP_DETAIL):
+    # ISO codes of the countries in the basemap, read once
+    if detail not in _country_ids:
+        with open(os.path.join(assets_folder, basemap_asset(detail))) as f:
+            _country_ids[detail] = [feature['id'] for feature in json.load(f)['features']]
+    return _country_ids[detail]
+
+def country_polygons(countries):
+    '''
+    Natural Earth countries with only the ISO code (as id) and the name,
+    in EPSG:4326.
+    '''
+    countries = countries.rename(columns=str.lower).to_crs(epsg=4326)
+
+    iso_codes = countries['iso_a3']
+    if 'adm0_a3' in countries:
+        iso_codes = iso_codes.where(iso_codes!='-99', countries['adm0_a3'])
+    iso_codes = iso_codes.where(iso_codes!='-99', countries['name'].map(ISO_CODE_FIXES))
+
+    countries = geopandas.GeoDataFrame({'id': iso_codes, 'name': countries['name']},
+                                       geometry=countries.geometry.values, crs=countries.crs)
+
+    return countries[countries['id'].notna()]
+
+def europe_countries(countries):
+    # the countries clipped to Europe, what the maps need of them
+    europe = country_polygons(countries)
+    europe = europe.set_geometry(shapely.clip_by_rect(europe.geometry.values, *EUROPE_BOUNDS))
+
+    return europe[~europe.geometry.is_empty]
+
+def simplify_countries(europe, tolerance, grid_size):
+    '''
+    The countries with every border simplified once, rather than once per
+    country on each side of it, so neighbours keep meeting without gaps or
+    overlaps. Their outlines are split into arcs where they meet, the arcs
+    are simplified together (keeping their ends, and without one crossing
+    another), and each face the arcs enclose goes back to the country it
+    lies in. Faces in no country, like seas enclosed by coasts, are dropped.
+    '''
+    # on the grid first, so borders that nearly coincide in the source do
+    geometry = shapely.set_precision(europe.geometry.values, grid_size)
+    arcs = shapely.line_merge(shapely.union_all(shapely.boundary(geometry)))
+    arcs = shapely.simplify(arcs, tolerance, preserve_topology=True)
+
+    faces = shapely.get_parts(shapely.polygonize(shapely.get_parts(arcs)))
+    face_index, country_index = shapely.STRtree(geometry).query(shapely.point_on_surface(faces),
+                                                                predicate='intersects')
+    # first country for faces on a border point
+    face_index, first = numpy.unique(face_index, return_index=True)
+    country_index = country_index[first]
+
+    simplified = numpy.full(len(geometry), None, dtype=object)
+    for country in numpy.unique(country_index):
+        simplified[country] = shapely.union_all(faces[face_index[country_index==country]], grid_size=grid_size)
+
+    keep = ~shapely.is_missing(simplified) & ~shapely.is_empty(simplified)
+    return europe.set_geometry(simplified)[keep]
+
+def build_basemap(assets_folder, source=NATURAL_EARTH_URL):
+
+    europe = europe_countries(geopandas.read_file(source))
+
+    os.makedirs(os.path.join(assets_folder, 'basemap'), exist_ok=True)
+    for detail, (tolerance, grid_size) in BASEMAP_LEVELS.items():
+        simplified = simplify_countries(europe, tolerance, grid_size)
+        path = os.path.join(assets_folder, basemap_asset(detail))
+        with open(path, 'w') as f:
+            f.write(simplified.set_index('id').to_json(drop_id=False, separators=(',', ':')))
+        print(f'Wrote {len(simplified)} countries to {path} ({os.path.getsize(path)//1024} KB)')
+
+    os.makedirs(os.path.join(assets_folder, TOPOJSON_DIR), exist_ok=True)
+    for name in TOPOJSON_NAMES:
+        with open(os.path.join(assets_folder, TOPOJSON_DIR, f'{name}.json'), 'w') as f:
+            json.dump({'type': 'Topology', 'arcs': [],
+                       'objects': {layer: {'type': 'GeometryCollection', 'geometries': []}
+                                   for layer in TOPOJSON_LAYERS}}, f)
+
+def apply_basemap(fig, geojson_url, country_ids, landcolor, oceancolor):
+    '''
+    Points a map's choropleth traces at the local basemap and draws every
+    basemap country underneath in the land colour, in place of plotly's own
+    land and ocean layers. The graphs' topojsonURL has to point at
+    TOPOJSON_DIR, see above.
+    '''
+    fig.update_traces(geojson=geojson_url, locationmode='geojson-id', featureidkey='id',
+                      selector=dict(type='choropleth'))
+
+    fig.add_choropleth(geojson=geojson_url, locationmode='geojson-id', featureidkey='id',
+                       locations=country_ids, z=[0]*len(country_ids),
+                       colorscale=[[0, landcolor], [1, landcolor]], showscale=False,
+                       hoverinfo='skip', coloraxis=None)
+    # underneath the data
+    fig.data = fig.data[-1:] + fig.data[:-1]
+
+    fig.update_geos(visible=False, bgcolor=oceancolor)
+
+    return fig
+
+
+if __name__ == '__main__':
+    build_basemap(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets'), *sys.argv[1:2])
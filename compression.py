@@ -0,0 +1,88 @@
+import os
+import gzip
+import hashlib
+
+import flask
+
+# brotli is optional; without it responses are only gzipped
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from figure_cache import FIGURE_PLACEHOLDER
+
+# ****************************************
+# compressed responses
+# ****************************************
+
+# bodies smaller than this are sent as they are
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+# levels for bodies compressed once per dataset version, and the faster
+# ones for bodies compressed on every request
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 9))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', 11))
+FAST_GZIP_LEVEL = 6
+FAST_BROTLI_QUALITY = 5
+
+
+def accepted_encoding():
+    # the best encoding the client accepts, or None
+    accepted = flask.request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compress(body, encoding, fast=False):
+    if encoding == 'br':
+        return brotli.compress(body, quality=FAST_BROTLI_QUALITY if fast else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=FAST_GZIP_LEVEL if fast else GZIP_LEVEL, mtime=0)
+
+def compressed_body(body, encoding, figure_cache, key, version):
+    # compressing at the highest levels is slow, so bodies built from cached
+    # figures are compressed once per dataset version and kept next to them
+    return figure_cache.get_or_build(f'{key}.{encoding}', '', version,
+                                     lambda: compress(body, encoding))
+
+def compress_response(response, figure_cache, key=None, version=None):
+    '''
+    Compresses a response body with the client's preferred encoding. With
+    a key and dataset version the compressed bytes come from the figure
+    cache; otherwise they are compressed for this request only.
+    Compress before tagging a response with conditional_response, whose
+    ETag includes the encoding.
+    '''
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if (encoding is None or response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    if key is not None and version is not None:
+        response.set_data(compressed_body(body, encoding, figure_cache, key, version))
+    else:
+        response.set_data(compress(body, encoding, fast=True))
+    response.headers['Content-Encoding'] = encoding
+
+    return response
+
+def compress_callback_response(response, unspliced_body, figure_cache):
+    '''
+    Compresses a callback response that had cached figures spliced into
+    it. The body before splicing (placeholders and all) identifies it, and
+    the placeholders carry the dataset version it belongs to.
+    '''
+    placeholder = FIGURE_PLACEHOLDER.search(unspliced_body)
+    # one whose version was evicted since had its figures rebuilt from a newer
+    # version, and storing it under the old one would push a current one out
+    if placeholder is None or not figure_cache.has_version(placeholder.group(3).decode()):
+        return compress_response(response, figure_cache)
+
+    key = 'callback-' + hashlib.sha1(unspliced_body).hexdigest()[:16]
+    return compress_response(response, figure_cache, key, placeholder.group(3).decode())
@@ -0,0 +1,304 @@
+import os
+import abc
+import sys
+import time
+import concurrent.futures
+
+import httplib2
+import pandas
+import pygsheets
+from pygsheets.utils import format_addr
+
+from sheet_snapshots import (read_fresh_snapshot, read_fallback_snapshot, write_snapshot,
+                             numerize_df, project_columns)
+from schema import YEAR_COLUMNS
+
+# ****************************************
+# where the dashboard data comes from
+# ****************************************
+
+#PIPES_KEY = '1MX_6I2QW07lFFWMO-k3mjthBlQGFlv5aTMBmvbliYUY' # current version
+#PIPES_KEY = '1PKsCoVnfnCEalDBOF0Fmny0-pg1qy86DoReNHI-97WM' # Mar 2023 release
+PIPES_KEY = '1CktxlI1RgYUvKtL0iaNjnZszXFVjSj0JKgPnxkbm414' # Jan 2025 release
+TERMS_KEY = '1fziNYGHLG1uXozfNI6MGzwyUQt6R3-30PPfug6ZqcAk' # Jan 2025 release
+
+# name of each frame -> (spreadsheet key, sheet title, top left cell)
+SHEETS = {
+    'gas_pipes': (PIPES_KEY, 'Gas pipelines', 'A3'),
+    'oil_pipes': (PIPES_KEY, 'Oil/NGL pipelines', 'A3'),
+    'country_ratios_df': (PIPES_KEY, 'Country ratios by pipeline', 'A1'),
+    'region_df_orig': (PIPES_KEY, 'Country dictionary', 'A2'),
+    'terms_df_orig': (TERMS_KEY, 'Terminals', 'A3'),
+}
+
+# what each part of the dashboard reads: part -> {frame name: columns}.
+# Only these frames and columns are loaded; a sheet nothing reads (like
+# 'Oil/NGL pipelines') isn't fetched at all.
+DEPENDENCIES = {
+    # Dataset: which rows are kept, and the regions
+    'dataset': {
+        'gas_pipes': ['PipelineName'],
+        'terms_df_orig': ['Fuel', 'Wiki'],
+        'region_df_orig': ['Country', 'CountryISO3166-1alpha-3', 'EuropeanUnion', 'EuroGasTracker', 'Region'],
+    },
+    # the cube: fig_capacity, fig_length, fig_fid and the choropleths
+    'cube': {
+        'terms_df_orig': ['TerminalID', 'Country', 'Status', 'FIDStatus', 'FacilityType', 'CapacityInBcm/y'],
+        'country_ratios_df': ['Country', 'Status', 'FIDStatus', 'LengthMergedKmByCountry',
+                              'LengthPerCountryFraction'],
+    },
+    # the year cube: fig_year_counts
+    'year_cube': {
+        'terms_df_orig': ['TerminalID', 'Country', 'Status', 'FacilityType', 'CapacityInBcm/y', *YEAR_COLUMNS],
+        'country_ratios_df': ['Country', 'Status', 'LengthMergedKmByCountry', 'LengthPerCountryFraction',
+                              *YEAR_COLUMNS],
+    },
+    # fig_pipeline_map and the routes
+    'fig_pipeline_map': {
+        'gas_pipes': ['ProjectID', 'PipelineName', 'Status', 'Route'],
+        'country_ratios_df': ['ProjectID', 'Country'],
+    },
+    # the terminals on fig_capacity_map
+    'terminal_layer': {
+        'terms_df_orig': ['TerminalName', 'Country', 'Status', 'FacilityType', 'CapacityInBcm/y',
+                          'Latitude', 'Longitude'],
+    },
+    # the projects listed near a click on a map, found through their
+    # geometries (pipeline_geometries and terminal_points)
+    'nearby_projects': {
+        'gas_pipes': ['ProjectID', 'PipelineName', 'Status', 'Route'],
+        'terms_df_orig': ['TerminalName', 'Status', 'Latitude', 'Longitude'],
+    },
+}
+
+def sheet_columns(dependencies=DEPENDENCIES):
+    # frame name -> every column some part reads, each once
+    columns = {}
+    for frames in dependencies.values():
+        for name, frame_columns in frames.items():
+            columns.setdefault(name, [])
+            columns[name] += [column for column in frame_columns if column not in columns[name]]
+    return columns
+
+SHEET_COLUMNS = sheet_columns()
+
+# 'gsheets' (default) or 'files'
+DATA_SOURCE = os.environ.get('DATA_SOURCE', 'gsheets')
+# directory of <name>.parquet or <name>.csv files for the 'files' source
+DATA_DIR = os.environ.get('DATA_DIR',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+# seconds before a single sheets request is abandoned
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', 30))
+# attempts per spreadsheet, waiting FETCH_BACKOFF, 2*FETCH_BACKOFF, ... in between
+FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES', 3))
+FETCH_BACKOFF = float(os.environ.get('FETCH_BACKOFF', 1))
+
+
+class DataSource(abc.ABC):
+    '''
+    Provides the raw frames the dashboard is built from, as a dict keyed by
+    the names in SHEETS, before any cleaning. By default these are the
+    frames and columns in SHEET_COLUMNS; columns maps a frame name to the
+    columns to load instead (None for all of them).
+    '''
+    def load(self, names=None, max_age=None, columns=SHEET_COLUMNS):
+        # max_age is how old a cached copy may be, for sources that cache
+        return {name: self.load_sheet(name, columns.get(name)) for name in (names or columns)}
+
+    @abc.abstractmethod
+    def load_sheet(self, name, columns=None):
+        pass
+
+
+class GoogleSheetsSource(DataSource):
+    '''
+    Reads worksheets from local snapshots when fresh (see sheet_snapshots.py).
+    The rest are fetched with one batched values request per spreadsheet,
+    with the spreadsheets fetched concurrently, so a cold boot takes as long
+    as the slowest spreadsheet rather than the sum of all sheets.
+    '''
+    def load_sheet(self, name, columns=None):
+        return self.load([name], columns={name: columns})[name]
+
+    def load(self, names=None, max_age=None, columns=SHEET_COLUMNS):
+        names = names or list(columns)
+        columns = {name: columns.get(name) for name in names}
+
+        data = {}
+        to_fetch = {}
+        for name in names:
+            spreadsheet_key, sheet_title, start = SHEETS[name]
+            df = read_fresh_snapshot(spreadsheet_key, sheet_title, start, max_age=max_age, columns=columns[name])
+            if df is None:
+                to_fetch.setdefault(spreadsheet_key, []).append(name)
+            else:
+                data[name] = df
+
+        if to_fetch:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(to_fetch))
+            futures = {executor.submit(self.fetch_with_retries, spreadsheet_key, sheet_names, columns): sheet_names
+                       for spreadsheet_key, sheet_names in to_fetch.items()}
+            # a hung request must not hold up the boot once its timeout is over
+            executor.shutdown(wait=False)
+
+            # every attempt makes up to four requests (token, metadata,
+            # headers, values)
+            deadline = time.monotonic()+FETCH_RETRIES*4*FETCH_TIMEOUT+FETCH_BACKOFF*2**FETCH_RETRIES
+            for future, sheet_names in futures.items():
+                try:
+                    raw_dfs = future.result(timeout=max(0, deadline-time.monotonic()))
+                except Exception as error:
+                    for name in sheet_names:
+                        data[name] = read_fallback_snapshot(error, *SHEETS[name], columns=columns[name])
+                    continue
+
+                for name, raw_df in raw_dfs.items():
+                    write_snapshot(raw_df, *SHEETS[name], columns=columns[name])
+                    data[name] = numerize_df(raw_df)
+
+        return {name: data[name] for name in names}
+
+    def fetch_with_retries(self, spreadsheet_key, names, columns):
+        for attempt in range(FETCH_RETRIES):
+            try:
+                return self.fetch_spreadsheet(spreadsheet_key, names, columns)
+            except Exception as error:
+                if attempt == FETCH_RETRIES-1:
+                    raise
+                print(f'Fetching {spreadsheet_key} failed ({error!r}); retrying')
+                time.sleep(FETCH_BACKOFF*2**attempt)
+
+    def fetch_spreadsheet(self, spreadsheet_key, names, columns):
+        '''
+        Fetches the given sheets of one spreadsheet in a single batchGet and
+        returns unnumerized frames, as get_as_df(numerize=False) would. Of
+        sheets with columns given, the header rows are fetched first (in
+        one batchGet too) and then only the ranges of those columns.
+        '''
+        # httplib2 is not thread-safe, so every fetch gets its own client
+        gc = pygsheets.authorize(service_account_env_var='GDRIVE_API_CREDENTIALS',
+                                 http=httplib2.Http(timeout=FETCH_TIMEOUT))
+        spreadsheet = gc.open_by_key(spreadsheet_key)
+
+        # name -> (sheet title, first row, first column, last row, last column)
+        extents = {}
+        for name in names:
+            _, sheet_title, start = SHEETS[name]
+            worksheet = spreadsheet.worksheet('title', sheet_title)
+            extents[name] = (sheet_title, *format_addr(start, 'tuple'), worksheet.rows, worksheet.cols)
+
+        def a1_range(name, first_row, first_col, last_row, last_col):
+            return (f"'{extents[name][0]}'!{format_addr((first_row, first_col), 'label')}:"
+                    f"{format_addr((last_row, last_col), 'label')}")
+
+        projected = [name for name in names if columns.get(name) is not None]
+        headers = {}
+        if projected:
+            fetched = gc.sheet.values_batch_get(spreadsheet_key, [
+                a1_range(name, extents[name][1], extents[name][2], extents[name][1], extents[name][4])
+                for name in projected])
+            for name, value_range in zip(projected, fetched):
+                headers[name] = (value_range.get('values') or [[]])[0]
+
+        # (name, range) for every range to fetch; a whole sheet is one range,
+        # the columns of a projected sheet one per run of adjacent columns
+        value_ranges = []
+        for name in names:
+            _, first_row, first_col, last_row, last_col = extents[name]
+            if name not in headers:
+                value_ranges.append((name, a1_range(name, first_row, first_col, last_row, last_col)))
+                continue
+            for first, last in column_runs(column_positions(headers[name], columns[name])):
+                value_ranges.append((name, a1_range(name, first_row, first_col+first, last_row, first_col+last)))
+
+        # pygsheets returns the response's valueRanges list, in request order
+        fetched = gc.sheet.values_batch_get(spreadsheet_key, [value_range for _, value_range in value_ranges])
+
+        blocks = {}
+        for (name, _), value_range in zip(value_ranges, fetched):
+            blocks.setdefault(name, []).append(value_range.get('values', [[]]))
+
+        raw_dfs = {}
+        for name in names:
+            values = join_blocks(blocks[name])
+            raw_df = pandas.DataFrame(values[1:], columns=values[0])
+            raw_dfs[name] = project_columns(raw_df, columns.get(name))
+
+        return raw_dfs
+
+def column_positions(header, columns):
+    # positions of the columns in a header row (of their first occurrence)
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise KeyError(f'Sheet has no column {", ".join(map(repr, missing))}')
+    return sorted({header.index(column) for column in columns})
+
+def column_runs(positions):
+    # sorted positions as (first, last) runs of adjacent ones
+    runs = []
+    for position in positions:
+        if runs and runs[-1][1] == position-1:
+            runs[-1][1] = position
+        else:
+            runs.append([position, position])
+    return [tuple(run) for run in runs]
+
+def join_blocks(blocks):
+    '''
+    Side by side rows of value ranges of the same rows. The API leaves out
+    trailing empty cells and rows, so every block is padded to its width
+    and all of them to the longest.
+    '''
+    widths = [max(len(row) for row in block) for block in blocks]
+    n_rows = max(len(block) for block in blocks)
+
+    rows = []
+    for i in range(n_rows):
+        row = []
+        for block, width in zip(blocks, widths):
+            cells = block[i] if i < len(block) else []
+            row += cells+['']*(width-len(cells))
+        rows.append(row)
+
+    return rows
+
+
+class FileSource(DataSource):
+    '''
+    Reads local fixture files, e.g. written by `python data_sources.py <dir>`.
+    CSV files are numerized like get_as_df so they give the same frames.
+    '''
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+
+    def load_sheet(self, name, columns=None):
+        path = os.path.join(self.data_dir, name)
+        if os.path.exists(f'{path}.parquet'):
+            return project_columns(pandas.read_parquet(f'{path}.parquet', columns=columns), columns)
+        if os.path.exists(f'{path}.csv'):
+            df = pandas.read_csv(f'{path}.csv', dtype=str, keep_default_na=False, usecols=columns)
+            return project_columns(numerize_df(df), columns)
+        raise FileNotFoundError(f"No fixture for '{name}' in {self.data_dir}")
+
+
+DATA_SOURCES = {
+    'gsheets': GoogleSheetsSource,
+    'files': FileSource,
+}
+
+def get_data_source(name=None):
+    name = name or DATA_SOURCE
+    if name not in DATA_SOURCES:
+        raise ValueError(f"Unknown DATA_SOURCE '{name}', expected one of {list(DATA_SOURCES)}")
+    return DATA_SOURCES[name]()
+
+def save_fixtures(data, data_dir):
+    os.makedirs(data_dir, exist_ok=True)
+    for name, df in data.items():
+        df.to_csv(os.path.join(data_dir, f'{name}.csv'), index=False)
+
+
+if __name__ == '__main__':
+    # dump the configured source to fixture files for DATA_SOURCE=files
+    save_fixtures(get_data_source().load(), sys.argv[1] if len(sys.argv) > 1 else DATA_DIR)
@@ -0,0 +1,164 @@
+import os
+import hashlib
+import threading
+
+import pandas
+
+from data_sources import get_data_source
+from aggregates import build_cube, build_year_cube
+from schema import typed_frames
+from routes import pipeline_geometries, simplify_routes
+from terminals import terminal_points
+from spatial_index import ProjectIndex
+
+# ****************************************
+# versioned dataset and background refresh
+# ****************************************
+
+# seconds between background re-pulls of the sheets; 0 disables refreshing
+REFRESH_INTERVAL = float(os.environ.get('REFRESH_INTERVAL', 60*60))
+
+# region -> (label, column of the country dictionary, value it must have)
+REGIONS = {
+    'eu': ('European Union', 'EuropeanUnion', 'Yes'),
+    'egt': ('Europe Gas Tracker countries', 'EuroGasTracker', 'Yes'),
+    'europe': ('Europe', 'Region', 'Europe'),
+}
+DEFAULT_REGION = 'eu'
+
+
+def dataset_version(data):
+    '''
+    Short hash of the raw frames, so unchanged sheets give the same version
+    and nothing needs rebuilding.
+    '''
+    digest = hashlib.sha1()
+    for name in sorted(data):
+        df = data[name]
+        digest.update(name.encode())
+        digest.update(str(list(df.columns)).encode())
+        digest.update(pandas.util.hash_pandas_object(df, index=False).values.tobytes())
+
+    return digest.hexdigest()[:12]
+
+
+class Dataset:
+    '''
+    One version of the cleaned dashboard data and the aggregates built from it.
+    Never modified once it is published; a refresh builds a new Dataset and
+    swaps it in, so a request always sees a single consistent version.
+    '''
+    def __init__(self, data, version=None):
+
+        self.version = version or dataset_version(data)
+
+        # declared columns as years, floats and categoricals (see schema.py)
+        data = typed_frames(data)
+
+        # ****************************************
+        # pipelines
+
+        # remove empty cells for pipes, owners
+        pipes_df_orig = data['gas_pipes'][data['gas_pipes']['PipelineName']!='']
+
+        # route geometries, and the routes that couldn't be read by ProjectID
+        self.pipes_gdf, self.route_errors = pipeline_geometries(pipes_df_orig)
+        # the routes at each level of detail of the pipeline map
+        self.route_lods = simplify_routes(self.pipes_gdf.geometry.to_numpy())
+
+        #get other relevant sheets
+        self.country_ratios_df = data['country_ratios_df']
+
+        # ****************************************
+        # regional info
+
+        region_df_orig = data['region_df_orig']
+        self.region_df_orig = region_df_orig
+
+        # region -> its rows of the country dictionary
+        self.regions = {region: region_df_orig.copy()[region_df_orig[column]==value]
+                        for region, (_, column, value) in REGIONS.items()}
+
+        # Country -> ISO 3166 alpha-3 code for the choropleths, first entry wins
+        self.country_iso_codes = region_df_orig.drop_duplicates('Country').set_index(
+            'Country')['CountryISO3166-1alpha-3']
+
+        # ****************************************
+        # terminals
+
+        # -- is already NaN (see schema.py)
+        terms_df_orig = data['terms_df_orig']
+        # remove oil export terminals
+        terms_df_orig = terms_df_orig.loc[terms_df_orig['Fuel']=='LNG']
+        # remove anything without a wiki page
+        terms_df_orig = terms_df_orig.loc[terms_df_orig['Wiki']!='']
+        self.terms_df_orig = terms_df_orig
+
+        # numeric locations and points; terminals without latlon coords
+        # have NaN and None there
+        self.terms_gdf = terminal_points(self.terms_df_orig)
+
+        # pipelines and terminals near a point, for clicks on the maps
+        self.project_index = ProjectIndex(self.pipes_gdf, self.terms_gdf)
+
+        # ****************************************
+        # aggregates the figures are sliced from
+
+        # neither depends on the region, every region is a slice of them
+        self.cube = build_cube(self.terms_df_orig, self.country_ratios_df)
+        self.year_cube = build_year_cube(self.terms_df_orig, self.country_ratios_df)
+
+
+
+_dataset = None
+_swap_lock = threading.Lock()
+
+def current_dataset():
+    # read once per request and keep the reference; a concurrent swap never
+    # changes a Dataset that is already in use
+    return _dataset
+
+def load_dataset(warm_up, max_age=None):
+    '''
+    Loads the sheets and, if they changed, builds a new Dataset and calls
+    warm_up on it (to build what the first requests need, so they are as
+    fast as any other) before publishing it.
+    '''
+    global _dataset
+
+    data = get_data_source().load(max_age=max_age)
+    version = dataset_version(data)
+
+    # one refresh at a time; the swap itself is a single reference assignment
+    with _swap_lock:
+        if _dataset is not None and _dataset.version == version:
+            return _dataset
+
+        dataset = Dataset(data, version)
+        warm_up(dataset)
+        _dataset = dataset
+
+    return dataset
+
+
+class DataRefresher(threading.Thread):
+    '''
+    Re-pulls the sheets every `interval` seconds off the request path.
+    '''
+    def __init__(self, warm_up, interval=REFRESH_INTERVAL):
+        super().__init__(name='data-refresher', daemon=True)
+        self.warm_up = warm_up
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                # a snapshot written by another worker during this interval
+                # is recent enough, so workers don't all hit the sheets API
+                load_dataset(self.warm_up, max_age=self.interval/2)
+            except Exception as error:
+                print(f'Refreshing the data failed ({error!r}); keeping version {_dataset.version}')
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import shutil
+
+import plotly
+
+# a one-off export, no background refresh
+os.environ['REFRESH_INTERVAL'] = '0'
+
+import app
+from dataset import current_dataset, REGIONS, DEFAULT_REGION
+from plotly_bundle import use_bundle, bundle_file
+from basemap import TOPOJSON_DIR
+from http_caching import code_version
+
+# ****************************************
+# static export for CDN hosting
+# ****************************************
+# Writes the dashboard as plain files (index.html, one JSON file per figure
+# and region, and the assets) that can be served from object storage.
+# Run it again after the sheets change, e.g. from a scheduled job:
+#
+#     python export_static.py <output dir>
+#
+# It does nothing if the output already holds the current dataset version,
+# exported by the same code and assets.
+
+INDEX_HTML = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+{stylesheets}
+<script src="assets/plotly.min.js"></script>
+</head>
+<body>
+<div class="container-fluid">
+  <select id="region_select" class="form-select my-2" style="max-width:300px"></select>
+  <ul id="tabs" class="nav nav-tabs"></ul>
+  <div id="tab_content" class="container-fluid"></div>
+</div>
+<script>
+const REGIONS = {regions};
+const TABS = {tabs};
+const TAB_GRID = {tab_grid};
+const PLOT_CONFIG = {plot_config};
+let state = {{tab: '{default_tab}', region: '{default_region}'}};
+
+function render() {{
+  document.querySelectorAll('#tabs .nav-link').forEach(link => {{
+    const active = link.dataset.tab === state.tab;
+    link.classList.toggle('active', active);
+    link.style.color = active ? '#839496' : '#002b36';
+  }});
+  const content = document.getElementById('tab_content');
+  content.innerHTML = '';
+  TAB_GRID[state.tab].forEach(row => {{
+    const rowDiv = document.createElement('div');
+    rowDiv.className = 'row justify-content-center';
+    // the graphs only; the projects near a click need the server
+    row.filter(cell => cell.figure_id).forEach(cell => {{
+      const col = document.createElement('div');
+      col.className = `col-lg-${{cell.lg}} col-md-12`;
+      col.style.height = cell.height || '';
+      rowDiv.appendChild(col);
+      fetch(`figures/${{state.region}}/${{cell.figure_id}}.json`)
+        .then(response => response.json())
+        .then(fig => Plotly.newPlot(col, fig.data, fig.layout, {{...PLOT_CONFIG, ...cell.config}}));
+    }});
+    content.appendChild(rowDiv);
+  }});
+}}
+
+const select = document.getElementById('region_select');
+Object.entries(REGIONS).forEach(([region, label]) => select.add(new Option(label, region)));
+select.value = state.region;
+select.onchange = () => {{ state.region = select.value; render(); }};
+
+const tabs = document.getElementById('tabs');
+Object.entries(TABS).forEach(([tab, label]) => {{
+  const item = document.createElement('li');
+  item.className = 'nav-item';
+  item.innerHTML = `<a class="nav-link" href="#" data-tab="${{tab}}">${{label}}</a>`;
+  item.firstChild.onclick = event => {{ event.preventDefault(); state.tab = tab; render(); }};
+  tabs.appendChild(item);
+}});
+
+render();
+</script>
+</body>
+</html>
+'''
+
+
+def relative_asset_urls(figure_json):
+    # the server's /assets/... urls in a figure (e.g. the basemap's) as
+    # assets/..., relative to the export's index.html
+    return figure_json.replace(b'"' + app.app.get_asset_url('').encode(), b'"assets/')
+
+def export_static(out_dir):
+
+    dataset = current_dataset()
+
+    # the plotly.js dash would otherwise serve, the partial bundle if there is one
+    if use_bundle(app.app.config.assets_folder):
+        plotly_js = bundle_file(app.app.config.assets_folder)
+    else:
+        plotly_js = os.path.join(os.path.dirname(plotly.__file__), 'package_data', 'plotly.min.js')
+
+    version = {'version': dataset.version, 'code': code_version([plotly_js])}
+    version_path = os.path.join(out_dir, 'version.json')
+    if os.path.exists(version_path):
+        with open(version_path) as f:
+            if json.load(f) == version:
+                print(f'{out_dir} already holds version {dataset.version}')
+                return
+
+    # the figures the tabs show (not the pipeline map's other levels of
+    # detail), with the same fig_* functions and cache the server uses
+    figure_ids = [cell['figure_id'] for rows in app.TAB_GRID.values() for row in rows
+                  for cell in row if 'figure_id' in cell]
+    for region in REGIONS:
+        os.makedirs(os.path.join(out_dir, 'figures', region), exist_ok=True)
+        for figure_id in figure_ids:
+            with open(os.path.join(out_dir, 'figures', region, f'{figure_id}.json'), 'wb') as f:
+                f.write(relative_asset_urls(app.figure_json(dataset, region, figure_id)))
+
+    # the app's assets plus plotly.js
+    shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets'),
+                    os.path.join(out_dir, 'assets'), dirs_exist_ok=True)
+    shutil.copy(plotly_js, os.path.join(out_dir, 'assets', 'plotly.min.js'))
+
+    # the assets folder files under the fingerprinted names the server uses
+    # (the cached figures link e.g. the basemap by them)
+    for path in app.static_assets.files():
+        shutil.copy(app.static_assets.asset_file(path),
+                    os.path.join(out_dir, 'assets', app.static_assets.fingerprinted_path(path)))
+    local_stylesheets = ['assets/' + app.static_assets.fingerprinted_path(path)
+                         for path in app.static_assets.stylesheets()]
+
+    # the graphs' config, with urls relative to the export
+    plot_config = {**app.graph_config(), 'responsive': True}
+    if 'topojsonURL' in plot_config:
+        plot_config['topojsonURL'] = 'assets/' + TOPOJSON_DIR
+
+    stylesheets = '\n'.join(f'<link rel="stylesheet" href="{href}">'
+                            for href in [href for href in app.external_stylesheets if '://' in href]
+                            + local_stylesheets)
+    with open(os.path.join(out_dir, 'index.html'), 'w') as f:
+        f.write(INDEX_HTML.format(title=app.app.title,
+                                  stylesheets=stylesheets,
+                                  regions=json.dumps({region: label for region, (label, _, _) in REGIONS.items()}),
+                                  tabs=json.dumps(app.TABS),
+                                  tab_grid=json.dumps(app.TAB_GRID),
+                                  plot_config=json.dumps(plot_config),
+                                  default_tab=app.DEFAULT_TAB,
+                                  default_region=DEFAULT_REGION))
+
+    # written last, so an interrupted export is redone next time
+    with open(version_path, 'w') as f:
+        json.dump(version, f)
+
+    print(f'Exported version {dataset.version} to {out_dir}')
+
+
+if __name__ == '__main__':
+    export_static(sys.argv[1] if len(sys.argv) > 1 else 'static_export')
@@ -0,0 +1,74 @@
+import re
+import threading
+
+import plotly.io
+
+# ****************************************
+# pre-serialized figures
+# ****************************************
+
+class FigureCache:
+    '''
+    JSON bytes of built figures (and of anything assembled from them, like
+    the layout) keyed by (figure id, region, dataset version), so a response
+    can send them without plotly validating and encoding the figure again.
+    Only the latest `max_versions` dataset versions are kept; the previous
+    one stays around for requests still in flight during a swap.
+    '''
+    def __init__(self, max_versions=2):
+        self.max_versions = max_versions
+        self._entries = {}
+        self._versions = []
+        self._lock = threading.Lock()
+
+    def put(self, figure_id, region, version, figure):
+
+        if not isinstance(figure, bytes):
+            figure = plotly.io.to_json(figure, validate=False).encode()
+
+        with self._lock:
+            if version not in self._versions:
+                self._versions.append(version)
+                old_versions = self._versions[:-self.max_versions]
+                self._versions = self._versions[-self.max_versions:]
+                self._entries = {key: value for key, value in self._entries.items()
+                                 if key[2] not in old_versions}
+            self._entries[(figure_id, region, version)] = figure
+
+        return figure
+
+    def get(self, figure_id, region, version):
+        return self._entries.get((figure_id, region, version))
+
+    def has_version(self, version):
+        return version in self._versions
+
+    def get_or_build(self, figure_id, region, version, build):
+        # build returns a figure, or bytes that are stored as they are
+        figure = self.get(figure_id, region, version)
+        if figure is None:
+            figure = self.put(figure_id, region, version, build())
+        return figure
+
+
+def figure_placeholder(figure_id, region, version):
+    # stands in for a cached figure in a component tree, see splice_figures
+    return f'__figure__{figure_id}__{region}__{version}__'
+
+FIGURE_PLACEHOLDER = re.compile(rb'"__figure__(.+?)__(.+?)__(.+?)__"')
+
+def splice_figures(component_json, figure_cache, rebuild):
+    '''
+    Replaces every figure_placeholder string in serialized JSON (a layout or
+    a callback response) with the cached figure bytes it stands for. If its
+    version has been evicted since (two refreshes while the request ran),
+    rebuild(figure_id, region) gives the bytes to use instead.
+    '''
+    def cached_figure(match):
+        figure_id, region, version = (group.decode() for group in match.groups())
+        figure = figure_cache.get(figure_id, region, version)
+        if figure is None:
+            figure = rebuild(figure_id, region)
+        return figure
+
+    return FIGURE_PLACEHOLDER.sub(cached_figure, component_json)
@@ -0,0 +1,46 @@
+import os
+
+import pandas
+
+# ****************************************
+# files derived from other data
+# ****************************************
+
+def write_atomic(path, write):
+    '''
+    Writes a file with write(tmp_path) next to the target and renames it,
+    so another process (e.g. a worker booting at the same time) never reads
+    a half-written file.
+    '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def read_cache(cache_path, read=pandas.read_parquet):
+    # a missing or unreadable cache is just empty
+    try:
+        return read(cache_path)
+    except (OSError, ValueError):
+        return None
+
+def cached_rows(keys, compute, cache_path, read=pandas.read_parquet):
+    '''
+    The rows of a parquet cache for the given keys, its index (a key may
+    have several rows). compute(new_keys) gives the rows of keys missing
+    from the cache, at least one per key so it is known the next time; the
+    cache is then rewritten with just the keys in use.
+    '''
+    keys = pandas.Index(keys).unique()
+
+    cache = read_cache(cache_path, read)
+    if cache is None:
+        cache = compute(keys[:0])
+
+    in_use = cache[cache.index.isin(keys)]
+    new_keys = keys[~keys.isin(cache.index)]
+    if len(new_keys) or len(in_use) < len(cache):
+        in_use = pandas.concat([in_use, compute(new_keys)])
+        write_atomic(cache_path, in_use.to_parquet)
+
+    return in_use
@@ -0,0 +1,33 @@
+import os
+import gc
+
+# ****************************************
+# gunicorn settings, used by the Procfile
+# ****************************************
+
+# load the data and build the figures once in the master and fork the workers
+# from it, so they share those pages copy-on-write instead of each worker
+# holding its own copy of every frame and figure
+preload_app = os.environ.get('PRELOAD_APP', '1').lower() in ['1', 'true', 'yes']
+
+# a thread started in the master would not survive the fork (and could be
+# holding the dataset swap lock when it happens), so app.py leaves the
+# refresher to post_fork. Set here because this file is read before the
+# preload import; on_starting only runs after it.
+if preload_app:
+    os.environ['GUNICORN_PRELOAD'] = '1'
+
+def when_ready(server):
+    # move everything loaded so far out of the collector's reach, so its
+    # passes in the workers don't write to (and so copy) the shared pages
+    if server.cfg.preload_app:
+        gc.freeze()
+
+def post_fork(server, worker):
+    # each worker refreshes on its own; until the sheets change they keep
+    # sharing the master's dataset
+    if server.cfg.preload_app:
+        import app
+        # a refresher object inherited from the master has no thread here
+        app.refresher = None
+        app.start_refresher()
@@ -0,0 +1,69 @@
+import os
+import glob
+import hashlib
+
+import flask
+
+# ****************************************
+# HTTP caching of dash responses
+# ****************************************
+
+# seconds browsers and proxies may reuse the layout without asking again;
+# 0 means they keep it but revalidate with its ETag every time
+LAYOUT_MAX_AGE = int(os.environ.get('LAYOUT_MAX_AGE', 0))
+# the same for the index page and the callback dependencies
+PAGE_MAX_AGE = int(os.environ.get('PAGE_MAX_AGE', 0))
+
+
+# settings that change what the layout embeds (the basemap and its urls,
+# the plotly.js bundle), besides the code and the assets
+CODE_VERSION_SETTINGS = ['BASEMAP', 'BASEMAP_DETAIL', 'PLOTLY_BUNDLE']
+
+def code_version(extra_paths=()):
+    '''
+    Short hash of what the responses are made with besides the data: the
+    app's python files, the assets folder (whose fingerprinted urls the
+    layout links) and CODE_VERSION_SETTINGS, plus any extra_paths. A deploy
+    that changes any of them changes every ETag even when the data did not.
+    '''
+    app_dir = os.path.dirname(os.path.abspath(__file__))
+    paths = sorted(glob.glob(os.path.join(app_dir, '*.py')))
+    paths += sorted(os.path.join(current, f) for current, _, files in os.walk(os.path.join(app_dir, 'assets'))
+                    for f in files)
+
+    digest = hashlib.sha1()
+    for path in paths + list(extra_paths):
+        digest.update(os.path.relpath(path, app_dir).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    for setting in CODE_VERSION_SETTINGS:
+        digest.update(f'{setting}={os.environ.get(setting)}'.encode())
+
+    return digest.hexdigest()[:12]
+
+CODE_VERSION = code_version()
+
+def conditional_response(response, etag, max_age):
+    '''
+    Tags a response with an ETag and Cache-Control lifetime, and turns it
+    into a 304 Not Modified if the request's If-None-Match already has it.
+    '''
+    # a strong ETag has to differ between encodings of the same resource
+    encoding = response.headers.get('Content-Encoding')
+    response.set_etag(f'{etag}-{CODE_VERSION}' + (f'-{encoding}' if encoding else ''))
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if max_age == 0:
+        response.cache_control.no_cache = True
+
+    return response.make_conditional(flask.request)
+
+def tag_static_responses(response, paths):
+    # for GET responses that don't depend on the data, like the index page,
+    # the ETag is a hash of the body
+    if (flask.request.method == 'GET' and flask.request.path in paths
+            and response.status_code == 200 and not response.get_etag()[0]):
+        response.direct_passthrough = False
+        return conditional_response(response, hashlib.sha1(response.get_data()).hexdigest()[:12],
+                                    PAGE_MAX_AGE)
+    return response
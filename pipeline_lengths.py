@@ -0,0 +1,246 @@
+import os
+import sys
+import hashlib
+import concurrent.futures
+
+import numpy
+import pandas
+import geopandas
+import pyproj
+import shapely
+
+from sheet_snapshots import SNAPSHOT_DIR
+from file_cache import cached_rows
+from basemap import country_polygons
+from routes import NO_ROUTE_OPTIONS, route_hashes, pipeline_geometries
+
+# ****************************************
+# per-country pipeline km from the routes
+# ****************************************
+# The km figures use LengthMergedKmByCountry and LengthPerCountryFraction
+# of 'Country ratios by pipeline' as they come, including splits that had
+# to be patched by hand (app-old.py sets the Poland-Ukraine Interconnector
+# to 1.5 and 99 km). This recomputes the split from the parsed routes and
+# country polygons. Run
+#
+#     python pipeline_lengths.py [countries file or url] [ratios.csv]
+#
+# to list the pipelines whose split differs from the sheet's, and to write
+# the sheet with the recomputed lengths to ratios.csv.
+
+# country polygons with an ISO code; by default the Natural Earth ones
+# bundled with geopandas (1:110m)
+COUNTRY_POLYGONS = os.environ.get('COUNTRY_POLYGONS', geopandas.datasets.get_path('naturalearth_lowres'))
+
+# km per route and country by countries digest and route hash, so only new
+# routes are intersected
+COUNTRY_KM_CACHE_PATH = os.environ.get('COUNTRY_KM_CACHE_PATH', os.path.join(SNAPSHOT_DIR, 'country_km.parquet'))
+
+# processes intersecting routes, and routes per task
+LENGTH_WORKERS = int(os.environ.get('LENGTH_WORKERS', os.cpu_count() or 1))
+LENGTH_CHUNK_SIZE = 50
+
+# differences to the sheet that are reported
+KM_TOLERANCE = 5
+FRACTION_TOLERANCE = 0.05
+
+# country of the parts of a route outside every polygon (mostly offshore)
+NO_COUNTRY = ''
+
+_geod = pyproj.Geod(ellps='WGS84')
+
+
+def load_countries(source=COUNTRY_POLYGONS):
+    countries = country_polygons(geopandas.read_file(source))
+    # one (multi)polygon per country
+    return countries.dissolve(by='id', as_index=False)
+
+def countries_digest(countries):
+    # identifies the polygons the cached lengths were computed with
+    digest = hashlib.sha1()
+    digest.update(str(list(countries['id'])).encode())
+    for wkb in shapely.to_wkb(countries.geometry.values):
+        digest.update(wkb)
+    return digest.hexdigest()[:16]
+
+# ****************************************
+# intersecting routes with countries
+
+_worker_countries = None
+
+def init_worker(country_ids, country_geometries):
+    # each worker process gets the polygons and builds its index once
+    global _worker_countries
+    _worker_countries = (numpy.asarray(country_ids, dtype=object), shapely.STRtree(country_geometries))
+
+def routes_country_km(route_hashes, geometries):
+    '''
+    Geodesic km of each route (EPSG:4326 (Multi)LineStrings) in each
+    country it crosses, and outside all of them as NO_COUNTRY, as
+    route_hash, country, km rows. The NO_COUNTRY row is there even at 0 km,
+    so every route has one.
+    '''
+    country_ids, tree = _worker_countries
+    route_hashes = numpy.asarray(route_hashes, dtype=object)
+    geometries = numpy.asarray(geometries, dtype=object)
+
+    # the routes are straight between vertices in lon/lat (and in
+    # EPSG:4087, which only scales it), so the parts are cut in lon/lat
+    route_at, country_at = tree.query(geometries, predicate='intersects')
+    parts = shapely.intersection(geometries[route_at], tree.geometries[country_at])
+    part_km = numpy.array([_geod.geometry_length(part) for part in parts]) / 1000
+    total_km = numpy.array([_geod.geometry_length(geometry) for geometry in geometries]) / 1000
+
+    outside_km = total_km - numpy.bincount(route_at, weights=part_km, minlength=len(geometries))
+
+    return pandas.DataFrame({
+        'route_hash': numpy.concatenate([route_hashes[route_at], route_hashes]),
+        'country': numpy.concatenate([country_ids[country_at], numpy.full(len(geometries), NO_COUNTRY, dtype=object)]),
+        'km': numpy.concatenate([part_km, outside_km.clip(min=0)]),
+    }).query('km > 0 or country == @NO_COUNTRY')
+
+def compute_country_km(route_hashes, geometries, countries, workers=LENGTH_WORKERS):
+    '''
+    routes_country_km for many routes, in chunks over a process pool (or
+    in this process for a single worker or chunk).
+    '''
+    chunks = [(route_hashes[i:i+LENGTH_CHUNK_SIZE], geometries[i:i+LENGTH_CHUNK_SIZE])
+              for i in range(0, len(geometries), LENGTH_CHUNK_SIZE)]
+    init_args = (countries['id'].to_numpy(), countries.geometry.values)
+
+    if workers <= 1 or len(chunks) <= 1:
+        init_worker(*init_args)
+        results = [routes_country_km(*chunk) for chunk in chunks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(min(workers, len(chunks)), initializer=init_worker,
+                                                    initargs=init_args) as executor:
+            results = list(executor.map(routes_country_km, *zip(*chunks)))
+
+    empty = pandas.DataFrame({'route_hash': [], 'country': [], 'km': []})
+    return pandas.concat([empty]+results, ignore_index=True)
+
+# ****************************************
+# cache and per-pipeline lengths
+
+def cached_country_km(hashes, geometries, countries, cache_path=COUNTRY_KM_CACHE_PATH):
+    '''
+    route_hash, country, km rows for the given routes. Only routes missing
+    from the cache (for these countries) are intersected; the cache is
+    keyed by both.
+    '''
+    digest = countries_digest(countries)
+    routes = pandas.Series(geometries, index=digest+numpy.asarray(hashes, dtype=object))
+    routes = routes[~routes.index.duplicated()]
+
+    def compute(new_keys):
+        new_routes = routes[new_keys]
+        country_km = compute_country_km(new_routes.index.str[len(digest):].to_numpy(), new_routes.to_numpy(),
+                                        countries)
+        return country_km.set_index(digest+country_km['route_hash'].astype(str).rename('key'))
+
+    return cached_rows(routes.index, compute, cache_path)[['route_hash', 'country', 'km']]
+
+def pipeline_country_km(pipes_df, countries, country_names, cache_path=COUNTRY_KM_CACHE_PATH):
+    '''
+    Km of every pipeline with a route in every country it crosses (and
+    outside all of them as NO_COUNTRY), as ProjectID, Country,
+    RouteKmByCountry rows. Countries are named through country_names
+    (ISO code -> sheet name) where possible.
+    '''
+    pipes_gdf, _ = pipeline_geometries(pipes_df)
+    pipes_gdf = pipes_gdf[~pipes_df['Route'].isin(NO_ROUTE_OPTIONS) & pipes_gdf.geometry.notna()]
+    hashes = route_hashes(pipes_gdf['Route'].astype(str))
+
+    country_km = cached_country_km(hashes.to_numpy(), pipes_gdf.geometry.values, countries, cache_path)
+
+    lengths = pandas.DataFrame({'ProjectID': pipes_gdf['ProjectID'].to_numpy(),
+                                'route_hash': hashes.to_numpy()}).merge(country_km, on='route_hash')
+    lengths['Country'] = lengths['country'].map(country_names).fillna(
+        lengths['country'].map(countries.set_index('id')['name'])).fillna(NO_COUNTRY)
+    lengths = lengths.groupby(['ProjectID', 'Country'], as_index=False, sort=False)['km'].sum()
+
+    return lengths.rename(columns={'km': 'RouteKmByCountry'})
+
+# ****************************************
+# checking and regenerating the sheet
+
+def country_split(pipes_df, lengths):
+    '''
+    The sheet's columns as recomputed from the route lengths: the fraction
+    of the in-country part of each route in each country, applied to the
+    pipeline's LengthMergedKm (the route's length where that is missing),
+    as ProjectID, Country, LengthPerCountryFraction, LengthMergedKmByCountry
+    rows. Parts outside every country are left out.
+    '''
+    lengths = lengths[lengths['Country']!=NO_COUNTRY].copy()
+    lengths['LengthPerCountryFraction'] = lengths['RouteKmByCountry'] / \
+        lengths.groupby('ProjectID')['RouteKmByCountry'].transform('sum')
+
+    merged_km = pandas.to_numeric(pipes_df.set_index('ProjectID')['LengthMergedKm'], errors='coerce')
+    merged_km = lengths['ProjectID'].map(merged_km[~merged_km.index.duplicated()])
+    lengths['LengthMergedKmByCountry'] = (lengths['LengthPerCountryFraction']*merged_km).fillna(
+        lengths['RouteKmByCountry'])
+
+    return lengths[['ProjectID', 'Country', 'LengthPerCountryFraction', 'LengthMergedKmByCountry']]
+
+def compare_country_ratios(country_ratios_df, split):
+    '''
+    The sheet's and the recomputed split (from country_split) of every
+    pipeline with a route, side by side, where the km differ by more than
+    KM_TOLERANCE or the fraction by more than FRACTION_TOLERANCE, i.e.
+    where regenerate_country_ratios would change the sheet.
+    '''
+    columns = ['LengthPerCountryFraction', 'LengthMergedKmByCountry']
+    sheet = country_ratios_df[country_ratios_df['ProjectID'].isin(split['ProjectID'])]
+    sheet = sheet[['ProjectID', 'Country']].assign(
+        **{column: pandas.to_numeric(sheet[column], errors='coerce') for column in columns}
+    ).groupby(['ProjectID', 'Country'], as_index=False, observed=True).sum()
+
+    compared = sheet.merge(split, on=['ProjectID', 'Country'], how='outer',
+                           suffixes=('', 'FromRoutes')).fillna(0)
+    differs = ((compared['LengthMergedKmByCountry']-compared['LengthMergedKmByCountryFromRoutes']).abs() > KM_TOLERANCE) | \
+              ((compared['LengthPerCountryFraction']-compared['LengthPerCountryFractionFromRoutes']).abs() > FRACTION_TOLERANCE)
+
+    return compared[differs].sort_values(['ProjectID', 'Country'])
+
+def regenerate_country_ratios(country_ratios_df, split):
+    '''
+    The sheet with the recomputed split (from country_split) for the
+    pipelines with a route. Pipelines without a route keep their rows.
+    '''
+    # the other columns are per pipeline; take them from its first row
+    project_columns = [column for column in country_ratios_df.columns
+                       if column not in ['Country', 'LengthPerCountryFraction', 'LengthMergedKmByCountry']]
+    projects = country_ratios_df[project_columns].drop_duplicates('ProjectID')
+    recomputed = projects.merge(split, on='ProjectID')
+
+    kept = country_ratios_df[~country_ratios_df['ProjectID'].isin(split['ProjectID'])]
+    return pandas.concat([kept, recomputed[country_ratios_df.columns]], ignore_index=True)
+
+
+if __name__ == '__main__':
+    os.environ['REFRESH_INTERVAL'] = '0'
+    from data_sources import get_data_source
+
+    # the whole ratios sheet, to write it back with the new lengths
+    data = get_data_source().load(columns={
+        'gas_pipes': ['ProjectID', 'PipelineName', 'Route', 'LengthMergedKm'],
+        'country_ratios_df': None,
+        'region_df_orig': ['Country', 'CountryISO3166-1alpha-3'],
+    })
+    pipes_df = data['gas_pipes'][data['gas_pipes']['PipelineName']!='']
+    region_df = data['region_df_orig'].drop_duplicates('CountryISO3166-1alpha-3')
+    country_names = region_df.set_index('CountryISO3166-1alpha-3')['Country']
+
+    lengths = pipeline_country_km(pipes_df, load_countries(*sys.argv[1:2]), country_names)
+    split = country_split(pipes_df, lengths)
+
+    differences = compare_country_ratios(data['country_ratios_df'], split)
+    with pandas.option_context('display.max_rows', None, 'display.width', 200):
+        print(differences.to_string(index=False, float_format='{:.2f}'.format))
+    print(f'{differences["ProjectID"].nunique()} of {split["ProjectID"].nunique()} pipelines with a route '
+          'are split differently from the sheet')
+
+    if sys.argv[2:3]:
+        regenerate_country_ratios(data['country_ratios_df'], split).to_csv(sys.argv[2], index=False)
+        print(f'Wrote the recomputed country ratios to {sys.argv[2]}')
@@ -0,0 +1,91 @@
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+import plotly.offline
+
+# ****************************************
+# partial plotly.js bundle
+# ****************************************
+# The figures only use a few trace types, so instead of the full plotly.js
+# (about 3.5 MB) the browser can get a bundle with just those. Build it with
+#
+#     python plotly_bundle.py build
+#
+# (needs git, node and npm) and commit the file it writes to assets. While
+# that file exists and PLOTLY_BUNDLE isn't 0 it is linked ahead of the dash
+# scripts; dcc.Graph then uses it as window.Plotly instead of loading the
+# full bundle. A trace type missing from the bundle would silently not
+# render, so
+#
+#     python plotly_bundle.py check
+#
+# builds every figure for every region and fails on a trace type the
+# bundle is missing. It runs at the end of `build` too; run it in CI (or the
+# deploy's build step) whenever the figures change; requests don't check.
+
+# trace modules in the bundle; px.bar, px.choropleth and the route map
+BUNDLE_TRACE_TYPES = ['bar', 'choropleth', 'scattergeo']
+
+# path of the bundle in the assets folder
+BUNDLE_ASSET = 'plotly-dashboard.min.js'
+
+PLOTLY_BUNDLE = os.environ.get('PLOTLY_BUNDLE', '1') != '0'
+
+
+def bundle_file(assets_folder):
+    return os.path.join(assets_folder, BUNDLE_ASSET)
+
+def use_bundle(assets_folder):
+    return PLOTLY_BUNDLE and os.path.exists(bundle_file(assets_folder))
+
+def unsupported_trace_types(fig):
+    # trace types of a figure the partial bundle can't draw
+    return sorted({trace.type for trace in fig.data} - set(BUNDLE_TRACE_TYPES))
+
+def build_bundle(assets_folder):
+    '''
+    Builds the bundle from the plotly.js release the installed plotly uses,
+    with plotly.js's own custom bundle script.
+    '''
+    version = plotly.offline.get_plotlyjs_version()
+    with tempfile.TemporaryDirectory() as work_dir:
+        subprocess.run(['git', 'clone', '--depth', '1', '--branch', f'v{version}',
+                        'https://github.com/plotly/plotly.js.git', work_dir], check=True)
+        subprocess.run(['npm', 'ci'], cwd=work_dir, check=True)
+        subprocess.run(['npm', 'run', 'custom-bundle', '--', '--out', 'dashboard',
+                        '--traces', ','.join(BUNDLE_TRACE_TYPES), '--transforms', 'none'],
+                       cwd=work_dir, check=True)
+        shutil.copy(os.path.join(work_dir, 'dist', 'plotly-dashboard.min.js'), bundle_file(assets_folder))
+
+    print(f'Wrote plotly.js {version} with {", ".join(BUNDLE_TRACE_TYPES)} to {bundle_file(assets_folder)}')
+
+def check_figures():
+    # every figure of every region, built the way the server builds them
+    import app
+    from dataset import current_dataset, REGIONS
+
+    dataset = current_dataset()
+    problems = {}
+    for region in REGIONS:
+        for figure_id, build in app.FIGURES.items():
+            for trace_type in unsupported_trace_types(build(dataset, region)):
+                problems.setdefault(trace_type, set()).add(figure_id)
+
+    if problems:
+        sys.exit('\n'.join(f'{", ".join(sorted(figure_ids))} use {trace_type} traces, which {BUNDLE_ASSET} '
+                           'does not include; add them to BUNDLE_TRACE_TYPES and rebuild it'
+                           for trace_type, figure_ids in problems.items()))
+
+    print(f'All figures only use {", ".join(BUNDLE_TRACE_TYPES)} traces')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] not in [['build'], ['check']]:
+        sys.exit('usage: python plotly_bundle.py build|check')
+    if sys.argv[1:] == ['build']:
+        build_bundle(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets'))
+    os.environ['REFRESH_INTERVAL'] = '0'
+    check_figures()
@@ -0,0 +1,237 @@
+import os
+import io
+import csv
+import json
+import hashlib
+
+import numpy
+import pandas
+import geopandas
+import shapely
+
+from sheet_snapshots import SNAPSHOT_DIR
+from file_cache import cached_rows
+
+# ****************************************
+# pipeline routes to geometries
+# ****************************************
+# The Route column of the pipeline sheets (GFIT format) holds points as
+# 'lat,lon' separated by ':', and the branches of a branched pipeline
+# separated by ';':
+#
+#     47.1,19.2:47.3,19.8:47.9,20.1;47.3,19.8:46.9,20.5
+
+# Route values that mean there is no route to draw
+NO_ROUTE_OPTIONS = [
+    'Unavailable',
+    'Capacity expansion only',
+    'Bidirectionality upgrade only',
+    'Short route (< 100 km)',
+    'N/A',
+    ''
+]
+
+
+def tokenize_routes(routes):
+    '''
+    Splits every route string at once into flat arrays: one entry per
+    point (its 'lat,lon' token, branch and number of commas) and one per
+    branch (its pipeline), all as positions into routes. The separators
+    are located in one pass over the bytes of all routes joined together.
+    '''
+    # newline separates pipelines in the joined text, so none may be inside a route
+    text = '\n'.join(routes.str.replace('\n', ' ', regex=False))
+    buffer = numpy.frombuffer(text.encode(), dtype=numpy.uint8)
+
+    separator_at = numpy.flatnonzero((buffer==ord(':')) | (buffer==ord(';')) | (buffer==ord('\n')))
+    separators = buffer[separator_at]
+    ends_branch = separators != ord(':')
+
+    # the i-th token starts after the (i-1)-th separator
+    point_branch = numpy.concatenate([[0], numpy.cumsum(ends_branch)])
+    branch_pipeline = numpy.concatenate([[0], numpy.cumsum(separators[ends_branch]==ord('\n'))])
+    point_commas = numpy.bincount(numpy.searchsorted(separator_at, numpy.flatnonzero(buffer==ord(','))),
+                                  minlength=len(point_branch))
+
+    point_tokens = text.translate({ord(';'): ':', ord('\n'): ':'}).split(':')
+
+    return point_tokens, point_commas, point_branch, branch_pipeline
+
+def parse_points(point_tokens, point_commas):
+    '''
+    (lon, lat) of every 'lat,lon' token, and which of them are valid
+    points. All tokens are converted to floats in one go; tokens that
+    aren't two numbers become NaN.
+    '''
+    well_formed = point_commas == 1
+    if not well_formed.all():
+        point_tokens = list(point_tokens)
+        for i in numpy.flatnonzero(~well_formed):
+            point_tokens[i] = 'nan,nan'
+    # one 'lat,lon' line per point for pandas' C parser
+    numbers = pandas.read_csv(io.StringIO('\n'.join(point_tokens)), header=None, names=['lat', 'lon'],
+                              skip_blank_lines=False, skipinitialspace=True, na_filter=False,
+                              quoting=csv.QUOTE_NONE, low_memory=False)
+    lat, lon = (pandas.to_numeric(numbers[column], errors='coerce').to_numpy(dtype=float)
+                for column in ['lat', 'lon'])
+
+    valid = well_formed & (numpy.abs(lat)<=90) & (numpy.abs(lon)<=180)
+
+    return numpy.column_stack([lon, lat]), valid
+
+def parse_routes(routes):
+    '''
+    Converts GFIT route strings to LineStrings (MultiLineStrings for
+    branched pipelines) in bulk. Returns a GeoSeries indexed like routes,
+    with None where there is no usable route, and the problems found as
+    {index: [messages]}. Points that can't be read are left out of their
+    branch, and branches left with fewer than two points are dropped.
+    '''
+    routes = routes.astype(str)
+    labels = routes.index.to_numpy()
+    geometry = numpy.full(len(routes), None, dtype=object)
+    errors = []
+    if routes.empty:
+        return geopandas.GeoSeries(geometry, index=routes.index, crs='EPSG:4326'), {}
+
+    point_tokens, point_commas, point_branch, branch_pipeline = tokenize_routes(routes)
+    coords, valid = parse_points(point_tokens, point_commas)
+
+    # empty tokens, e.g. from a trailing ':', are skipped silently
+    bad_points = [i for i in numpy.flatnonzero(~valid) if point_tokens[i].strip()]
+    errors += [(labels[branch_pipeline[point_branch[i]]], f"{point_tokens[i]!r} is not a 'lat,lon' point")
+               for i in bad_points]
+
+    # one LineString per branch with at least two points
+    branch_points = numpy.bincount(point_branch[valid], minlength=len(branch_pipeline))
+    good_branch = branch_points >= 2
+    errors += [(labels[branch_pipeline[i]], 'a branch has fewer than two points')
+               for i in numpy.flatnonzero(~good_branch & (branch_points > 0))]
+
+    keep = valid & good_branch[point_branch]
+    lines = numpy.full(len(branch_pipeline), None, dtype=object)
+    if keep.any():
+        shapely.linestrings(coords[keep], indices=point_branch[keep], out=lines)
+
+    # a single branch stays a LineString, several become a MultiLineString
+    good_pipeline = branch_pipeline[good_branch]
+    pipeline_branches = numpy.bincount(good_pipeline, minlength=len(routes))
+    single = pipeline_branches[good_pipeline] == 1
+    geometry[good_pipeline[single]] = lines[good_branch][single]
+    if (~single).any():
+        shapely.multilinestrings(lines[good_branch][~single], indices=good_pipeline[~single], out=geometry)
+
+    errors += [(labels[i], 'no usable route') for i in numpy.flatnonzero(pipeline_branches==0)]
+
+    route_errors = {}
+    for label, message in errors:
+        route_errors.setdefault(label, []).append(message)
+
+    return geopandas.GeoSeries(geometry, index=routes.index, crs='EPSG:4326'), route_errors
+
+# ****************************************
+# geometry cache
+# ****************************************
+
+# parsed and projected routes by a hash of the route string, so a refresh
+# only parses the routes that changed
+ROUTE_CACHE_PATH = os.environ.get('ROUTE_CACHE_PATH', os.path.join(SNAPSHOT_DIR, 'routes.parquet'))
+
+# equidistant cylindrical, as app-old.py projected the routes
+PROJECTED_CRS = 'EPSG:4087'
+
+
+def route_hashes(routes):
+    return pandas.Series([hashlib.sha1(route.encode()).hexdigest()[:16] for route in routes],
+                         index=routes.index)
+
+def parse_new_routes(routes):
+    '''
+    Parses and projects routes (indexed by their hash) into rows for the
+    route cache: geometry, geometry_4087 and the route problems as JSON.
+    '''
+    geometry, route_errors = parse_routes(routes)
+
+    parsed = geopandas.GeoDataFrame({'errors': [json.dumps(route_errors.get(route_hash, []))
+                                                for route_hash in routes.index]},
+                                    geometry=geometry, index=routes.index)
+    parsed['geometry_4087'] = geometry.to_crs(PROJECTED_CRS)
+    parsed.index.name = 'route_hash'
+
+    return parsed
+
+def cached_route_geometries(routes, cache_path=ROUTE_CACHE_PATH):
+    '''
+    Geometries (EPSG:4326 and 4087) and problems of every route, indexed
+    like routes. Only routes missing from the cache are parsed; the cache
+    is then rewritten with just the routes in use.
+    '''
+    routes = routes.astype(str)
+    hashes = route_hashes(routes)
+    unique_routes = pandas.Series(routes.to_numpy(), index=hashes.to_numpy())
+    unique_routes = unique_routes[~unique_routes.index.duplicated()]
+
+    cache = cached_rows(unique_routes.index, lambda new_hashes: parse_new_routes(unique_routes[new_hashes]),
+                        cache_path, read=geopandas.read_parquet)
+
+    geometries = cache.loc[hashes.to_numpy()]
+    geometries.index = routes.index
+
+    return geometries
+
+def pipeline_geometries(pipes_df, cache_path=ROUTE_CACHE_PATH):
+    '''
+    The pipelines with their routes as geometry columns (geometry in
+    EPSG:4326 and geometry_4087, None for pipelines without a route), and
+    the route problems by ProjectID.
+    '''
+    has_route = ~pipes_df['Route'].isin(NO_ROUTE_OPTIONS)
+    geometries = cached_route_geometries(pipes_df.loc[has_route, 'Route'], cache_path).reindex(pipes_df.index)
+
+    pipes_gdf = geopandas.GeoDataFrame(pipes_df, geometry=geometries.geometry.set_crs('EPSG:4326'))
+    pipes_gdf['geometry_4087'] = geometries['geometry_4087'].set_crs(PROJECTED_CRS)
+
+    route_errors = {project_id: json.loads(errors)
+                    for project_id, errors in zip(pipes_df.loc[has_route, 'ProjectID'],
+                                                  geometries.loc[has_route, 'errors'])
+                    if errors != '[]'}
+
+    return pipes_gdf, route_errors
+
+# ****************************************
+# level of detail for the pipeline map
+# ****************************************
+
+# level -> (simplification tolerance in degrees, zoom from which it is
+# shown, relative to the whole-Europe view); about a pixel at that zoom
+ROUTE_LODS = [(0.05, 1), (0.01, 2), (0.002, 5), (0, 20)]
+
+
+def simplify_routes(geometry):
+    # the routes at every level of detail, built once per dataset version
+    return [geometry if tolerance == 0 else shapely.simplify(geometry, tolerance)
+            for tolerance, _ in ROUTE_LODS]
+
+def route_lod(zoom):
+    # the level of detail to show at a zoom relative to the Europe view
+    return max([lod for lod, (_, min_zoom) in enumerate(ROUTE_LODS) if zoom >= min_zoom], default=0)
+
+def line_coordinates(geometry, labels):
+    '''
+    lon and lat of all vertices of the (Multi)LineStrings, with a NaN gap
+    after each line so they can all go in a single trace, and each
+    geometry's label repeated for its vertices (None in the gaps).
+    '''
+    parts, part_geometry = shapely.get_parts(geometry, return_index=True)
+    coords, coord_part = shapely.get_coordinates(parts, return_index=True)
+
+    # every part's vertices move up by one gap per earlier part
+    positions = numpy.arange(len(coords)) + coord_part
+    lon = numpy.full(len(coords)+len(parts), numpy.nan)
+    lat = numpy.full(len(coords)+len(parts), numpy.nan)
+    lon[positions] = coords[:, 0]
+    lat[positions] = coords[:, 1]
+    text = numpy.full(len(coords)+len(parts), None, dtype=object)
+    text[positions] = numpy.asarray(labels, dtype=object)[part_geometry[coord_part]]
+
+    return lon, lat, text
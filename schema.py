@@ -0,0 +1,84 @@
+import os
+
+import numpy
+import pandas
+
+# ****************************************
+# typed frames
+# ****************************************
+# The sheets arrive with every column as Python objects. Before a Dataset
+# is built from them, the columns declared here get compact dtypes:
+# nullable ints for years, floats for capacities, lengths and coordinates,
+# and categoricals for the fields that repeat a handful of values. Cells
+# that don't fit the type (e.g. '' or 'Unknown' in a number column) become
+# missing. Columns not declared stay as they are.
+
+# 'numpy' (default) or 'pyarrow' for pyarrow backed numbers
+DTYPE_BACKEND = os.environ.get('DTYPE_BACKEND', 'numpy')
+
+DTYPES = {
+    'numpy': {'year': 'Int64', 'float': 'float64'},
+    'pyarrow': {'year': 'int64[pyarrow]', 'float': 'double[pyarrow]'},
+}
+
+YEAR_COLUMNS = ['CancelledYear', 'ShelvedYear', 'StartYearEarliest', 'ProposalYear', 'ConstructionYear']
+
+PIPES_SCHEMA = {
+    'Status': 'category',
+    'Fuel': 'category',
+    'FIDStatus': 'category',
+    'LengthMergedKm': 'float',
+}
+
+# name of each frame -> (column -> 'year', 'float' or 'category', cell
+# values that mean missing in every column)
+SCHEMAS = {
+    'gas_pipes': (PIPES_SCHEMA, []),
+    'oil_pipes': (PIPES_SCHEMA, []),
+    'country_ratios_df': ({
+        'Country': 'category',
+        'Status': 'category',
+        'FIDStatus': 'category',
+        'LengthPerCountryFraction': 'float',
+        'LengthMergedKmByCountry': 'float',
+        **{column: 'year' for column in YEAR_COLUMNS},
+    }, []),
+    'terms_df_orig': ({
+        'Country': 'category',
+        'Status': 'category',
+        'FacilityType': 'category',
+        'FIDStatus': 'category',
+        'Fuel': 'category',
+        'CapacityInBcm/y': 'float',
+        'Latitude': 'float',
+        'Longitude': 'float',
+        **{column: 'year' for column in YEAR_COLUMNS},
+    }, ['--']),
+}
+
+
+def typed_column(column, kind, backend=DTYPE_BACKEND):
+    if kind == 'category':
+        return column.astype('category')
+
+    numbers = pandas.to_numeric(column, errors='coerce')
+    if kind == 'year':
+        # years like 2025.5 aren't years
+        numbers = numbers.where(numbers.isna() | (numbers==numbers.round()))
+    return numbers.astype(DTYPES[backend][kind])
+
+def apply_schema(df, schema, na_values=(), backend=DTYPE_BACKEND):
+    '''
+    A copy of a raw frame with its declared columns typed and na_values
+    replaced by NaN everywhere.
+    '''
+    if len(na_values):
+        df = df.replace(list(na_values), numpy.nan)
+
+    return df.assign(**{column: typed_column(df[column], kind, backend)
+                        for column, kind in schema.items() if column in df})
+
+def typed_frames(data, backend=DTYPE_BACKEND):
+    # every raw frame that has a schema, typed; the others as they are
+    return {name: apply_schema(df, *SCHEMAS[name], backend=backend) if name in SCHEMAS else df
+            for name, df in data.items()}
@@ -0,0 +1,129 @@
+import os
+import re
+import time
+import hashlib
+
+import pandas
+from pygsheets.utils import numericise
+
+from file_cache import write_atomic
+
+# ****************************************
+# local snapshots of the google sheets
+# ****************************************
+
+# every worksheet that is fetched is written to a parquet file keyed by
+# spreadsheet key and sheet title, so later boots can skip the HTTP round-trips
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots'))
+
+# snapshots younger than this many seconds are used instead of fetching again
+SNAPSHOT_MAX_AGE = float(os.environ.get('SNAPSHOT_MAX_AGE', 24*60*60))
+
+# offline mode never touches the network; only existing snapshots are read
+OFFLINE_MODE = os.environ.get('OFFLINE_MODE', '').lower() in ['1', 'true', 'yes']
+
+
+def snapshot_path(spreadsheet_key, sheet_title, start='A1', columns=None):
+    # a sheet fetched with only some columns is kept apart from the whole
+    # sheet, under a digest of those columns
+
+    sheet_slug = re.sub('[^0-9A-Za-z]+', '_', sheet_title).strip('_')
+    if columns is not None:
+        sheet_slug += '_' + hashlib.sha1(repr(list(columns)).encode()).hexdigest()[:8]
+
+    return os.path.join(SNAPSHOT_DIR, spreadsheet_key, f'{sheet_slug}_{start}.parquet')
+
+def project_columns(df, columns):
+    '''
+    Just the given columns of a frame, in that order (the first one of
+    repeated headers). Raises KeyError if the sheet doesn't have one.
+    '''
+    if columns is None:
+        return df
+
+    df = df.loc[:, ~df.columns.duplicated()]
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise KeyError(f'Sheet has no column {", ".join(map(repr, missing))}')
+
+    return df[list(columns)]
+
+def numerize_df(raw_df):
+    '''
+    Applies the same cell conversion that get_as_df(numerize=True) does,
+    so a frame read back from a snapshot is identical to a live fetch.
+    '''
+    df = raw_df.apply(lambda col: col.map(numericise))
+    df.columns = [numericise(col) for col in raw_df.columns]
+
+    return df
+
+def to_snapshot_table(raw_df):
+    # sheet headers can be empty or repeated, which parquet does not allow,
+    # so the header is stored as the first row under positional names
+    table = pandas.DataFrame([list(raw_df.columns)]+raw_df.values.tolist())
+    table.columns = [str(col) for col in table.columns]
+
+    return table
+
+def from_snapshot_table(table):
+
+    raw_df = table.iloc[1:].reset_index(drop=True)
+    raw_df.columns = list(table.iloc[0])
+
+    return raw_df
+
+def read_snapshot(spreadsheet_key, sheet_title, start='A1', max_age=None, columns=None):
+    '''
+    The snapshot of a sheet with the given columns (None for all of them).
+    Without one, a snapshot of the whole sheet is projected to them.
+    '''
+    paths = [snapshot_path(spreadsheet_key, sheet_title, start, columns)]
+    if columns is not None:
+        paths.append(snapshot_path(spreadsheet_key, sheet_title, start))
+
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        if max_age is not None and time.time()-os.path.getmtime(path) > max_age:
+            continue
+        try:
+            return project_columns(numerize_df(from_snapshot_table(pandas.read_parquet(path))), columns)
+        except KeyError:
+            # taken before the columns were needed
+            continue
+
+    return None
+
+def write_snapshot(raw_df, spreadsheet_key, sheet_title, start='A1', columns=None):
+
+    write_atomic(snapshot_path(spreadsheet_key, sheet_title, start, columns),
+                 lambda path: to_snapshot_table(raw_df).to_parquet(path, index=False))
+
+def read_fresh_snapshot(spreadsheet_key, sheet_title, start='A1', max_age=None, columns=None):
+    '''
+    Returns the snapshot if it is fresh enough to skip fetching, otherwise
+    None. In offline mode any snapshot is used, and a missing one is an error.
+    '''
+    if OFFLINE_MODE:
+        df = read_snapshot(spreadsheet_key, sheet_title, start, columns=columns)
+        if df is None:
+            raise FileNotFoundError(f"Offline mode but no snapshot of '{sheet_title}' with the needed columns: "
+                                    f"{snapshot_path(spreadsheet_key, sheet_title, start, columns)}")
+        return df
+
+    if max_age is None:
+        max_age = SNAPSHOT_MAX_AGE
+
+    return read_snapshot(spreadsheet_key, sheet_title, start, max_age=max_age, columns=columns)
+
+def read_fallback_snapshot(error, spreadsheet_key, sheet_title, start='A1', columns=None):
+    # after a failed fetch, a stale snapshot is better than failing the boot;
+    # re-raises the fetch error if there is none
+    df = read_snapshot(spreadsheet_key, sheet_title, start, columns=columns)
+    if df is None:
+        raise error
+    print(f"Fetching '{sheet_title}' failed; using stale snapshot")
+
+    return df
@@ -0,0 +1,78 @@
+import os
+import math
+
+import numpy
+import pyproj
+import shapely
+
+from routes import PROJECTED_CRS
+
+# ****************************************
+# nearby projects
+# ****************************************
+# The pipeline routes and terminal points in STRtrees, built once per
+# dataset version, so a click on a map can be answered with the projects
+# near it without going through every geometry.
+
+# how far from a clicked point projects count as near (km)
+NEARBY_RADIUS_KM = float(os.environ.get('NEARBY_RADIUS_KM', 50))
+
+_to_projected = pyproj.Transformer.from_crs('EPSG:4326', PROJECTED_CRS, always_xy=True)
+
+
+class ProjectIndex:
+    '''
+    Spatial index of the pipelines and terminals with a location, on their
+    EPSG:4087 geometries. Queries return each project's name, status and
+    index label in its frame, with the distance as 'km'.
+    '''
+    def __init__(self, pipes_gdf, terms_gdf):
+        pipes_gdf = pipes_gdf[pipes_gdf['geometry_4087'].notna()]
+        terms_gdf = terms_gdf[terms_gdf['geometry_4087'].notna()]
+        self.pipe_tree = shapely.STRtree(pipes_gdf['geometry_4087'].to_numpy())
+        self.term_tree = shapely.STRtree(terms_gdf['geometry_4087'].to_numpy())
+        # just what a summary shows, in tree order; slicing frames would
+        # cost more than the query
+        self.pipe_fields = self.fields(pipes_gdf, 'PipelineName')
+        self.term_fields = self.fields(terms_gdf, 'TerminalName')
+
+    @staticmethod
+    def fields(gdf, name_column):
+        return (gdf[name_column].to_numpy(dtype=object), gdf['Status'].to_numpy(dtype=object),
+                gdf.index.to_numpy())
+
+    @staticmethod
+    def project(fields, position, km):
+        names, statuses, index = fields
+        return {'name': names[position], 'status': statuses[position], 'index': index[position], 'km': km}
+
+    @staticmethod
+    def _within(tree, lon, lat, radius_km):
+        '''
+        Positions in the tree of the geometries within radius_km of a point,
+        nearest first, and their distances in km.
+        '''
+        x, y = _to_projected.transform(lon, lat)
+        # EPSG:4087 stretches east-west distances by 1/cos(lat); the tree is
+        # queried with a radius that covers that, and the candidates'
+        # distances are measured with it undone around the point
+        scale = max(math.cos(math.radians(lat)), 0.1)
+        candidates = tree.query(shapely.points(x, y), predicate='dwithin', distance=radius_km*1000/scale)
+        local = shapely.transform(tree.geometries[candidates], lambda coords: (coords - [x, y]) * [scale, 1])
+        km = shapely.distance(local, shapely.points(0, 0)) / 1000
+
+        near = km <= radius_km
+        order = numpy.argsort(km[near], kind='stable')
+        return candidates[near][order], km[near][order]
+
+    def nearest_pipeline(self, lon, lat, max_km=NEARBY_RADIUS_KM):
+        # the pipeline closest to a point, or None if none is within max_km
+        positions, km = self._within(self.pipe_tree, lon, lat, max_km)
+        if not len(positions):
+            return None
+        return self.project(self.pipe_fields, positions[0], km[0])
+
+    def terminals_within(self, lon, lat, radius_km=NEARBY_RADIUS_KM):
+        # the terminals within radius_km of a point, nearest first
+        positions, km = self._within(self.term_tree, lon, lat, radius_km)
+        return [self.project(self.term_fields, position, distance) for position, distance in zip(positions, km)]
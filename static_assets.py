@@ -0,0 +1,199 @@
+import os
+import re
+import hashlib
+import mimetypes
+import pkgutil
+import threading
+
+import flask
+
+from compression import brotli, compress, accepted_encoding, COMPRESS_MIN_SIZE
+from file_cache import write_atomic
+
+# ****************************************
+# fingerprinted, precompressed static files
+# ****************************************
+# The dash component bundles already have fingerprinted names
+# (dash_renderer.v2_9_1m1680000000.min.js); the files of the assets folder
+# get one from asset_url (typography.<content hash>.css). Both are sent with
+# a year-long immutable Cache-Control, so browsers never ask for them again,
+# and brotli/gzip compressed. The compressed variants are written to
+# ASSET_CACHE_DIR ahead of time with
+#
+#     python static_assets.py
+#
+# (e.g. in the build step of a deploy; it doesn't load the data); a file
+# missing there is compressed at a faster level when it is first requested
+# and kept in memory.
+
+ASSET_CACHE_DIR = os.environ.get('ASSET_CACHE_DIR',
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), 'asset_cache'))
+IMMUTABLE_MAX_AGE = 365*24*60*60
+
+# what dash sets on fingerprinted component bundles
+DASH_FINGERPRINTED_MAX_AGE = 31536000
+
+mimetypes.add_type('application/geo+json', '.geojson')
+
+FINGERPRINTED_ASSET = re.compile(r'^(.+)\.([0-9a-f]{12})(\.[^./]+)$')
+
+
+def content_hash(body):
+    return hashlib.sha1(body).hexdigest()[:12]
+
+class StaticAssets:
+    '''
+    Serves the assets folder under fingerprinted names and sends those and
+    the dash component bundles precompressed with immutable caching.
+    '''
+    def __init__(self, app, cache_dir=ASSET_CACHE_DIR):
+        self.app = app
+        self.cache_dir = cache_dir
+        self.encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+        # asset path -> content hash, request path -> content hash of the body
+        self._asset_hashes = {}
+        self._body_hashes = {}
+        # (content hash, encoding) -> compressed bytes
+        self._compressed = {}
+        self._lock = threading.Lock()
+
+    def asset_file(self, path):
+        return os.path.join(self.app.config.assets_folder, *path.split('/'))
+
+    def asset_hash(self, path):
+        if path not in self._asset_hashes:
+            with open(self.asset_file(path), 'rb') as f:
+                self._asset_hashes[path] = content_hash(f.read())
+        return self._asset_hashes[path]
+
+    def fingerprinted_path(self, path):
+        # typography.css -> typography.<content hash>.css
+        name, extension = os.path.splitext(path)
+        return f'{name}.{self.asset_hash(path)}{extension}'
+
+    def asset_url(self, path):
+        return self.app.get_asset_url(self.fingerprinted_path(path))
+
+    def files(self, extension=''):
+        # paths of the assets folder files, in the order dash would include them
+        return sorted(os.path.relpath(os.path.join(current, f), self.app.config.assets_folder).replace(os.sep, '/')
+                      for current, _, files in os.walk(self.app.config.assets_folder)
+                      for f in files if f.endswith(extension))
+
+    def stylesheets(self):
+        return self.files('.css')
+
+    # ****************************************
+    # compressed variants
+
+    def cache_path(self, digest, encoding):
+        return os.path.join(self.cache_dir, f'{digest}.{encoding}')
+
+    def compressed(self, body, digest, encoding):
+        key = (digest, encoding)
+        if key not in self._compressed:
+            path = self.cache_path(digest, encoding)
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    compressed = f.read()
+            else:
+                compressed = compress(body, encoding, fast=True)
+            with self._lock:
+                self._compressed[key] = compressed
+
+        return self._compressed[key]
+
+    def precompress(self, body):
+        # writes the variants at the highest levels, unless already there
+        os.makedirs(self.cache_dir, exist_ok=True)
+        digest = content_hash(body)
+        for encoding in self.encodings:
+            path = self.cache_path(digest, encoding)
+            if not os.path.exists(path):
+                compressed = compress(body, encoding)
+                def write(tmp_path):
+                    with open(tmp_path, 'wb') as f:
+                        f.write(compressed)
+                write_atomic(path, write)
+
+    def precompress_all(self):
+        '''
+        Precompresses every assets folder file and every component bundle
+        the app registered (including the ones dash loads on demand).
+        '''
+        for path in self.files():
+            with open(self.asset_file(path), 'rb') as f:
+                self.precompress(f.read())
+
+        # generating the index registers the component bundles
+        with self.app.server.test_request_context():
+            self.app._setup_server()
+            self.app.index()
+        for namespace, paths in self.app.registered_paths.items():
+            for path in sorted(paths):
+                try:
+                    body = pkgutil.get_data(namespace, path)
+                except FileNotFoundError:
+                    # source maps dash registers but doesn't ship
+                    continue
+                self.precompress(body)
+
+    # ****************************************
+    # responses
+
+    def immutable_response(self, response, body, digest):
+        encoding = accepted_encoding()
+        if encoding is not None and len(body) >= COMPRESS_MIN_SIZE:
+            response.set_data(self.compressed(body, digest, encoding))
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+
+        return response
+
+    def serve_asset(self):
+        '''
+        Answers a request for a fingerprinted assets folder file; returns
+        None for anything else (an unknown or outdated fingerprint falls
+        through to dash's own asset route and a 404).
+        '''
+        prefix = self.app.config.routes_pathname_prefix + self.app.config.assets_url_path.strip('/') + '/'
+        if not flask.request.path.startswith(prefix):
+            return None
+        match = FINGERPRINTED_ASSET.match(flask.request.path[len(prefix):])
+        if match is None:
+            return None
+
+        name, digest, extension = match.groups()
+        path = name + extension
+        if '..' in path.split('/') or not os.path.isfile(self.asset_file(path)) or self.asset_hash(path) != digest:
+            return None
+
+        with open(self.asset_file(path), 'rb') as f:
+            body = f.read()
+        response = flask.Response(body, mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+
+        return self.immutable_response(response, body, digest)
+
+    def tag_component_suite(self, response):
+        # dash already sends fingerprinted bundles with a year-long max-age
+        if (flask.request.path.startswith(self.app.config.routes_pathname_prefix+'_dash-component-suites/')
+                and response.status_code == 200
+                and response.cache_control.max_age == DASH_FINGERPRINTED_MAX_AGE):
+            body = response.get_data()
+            if flask.request.path not in self._body_hashes:
+                self._body_hashes[flask.request.path] = content_hash(body)
+            return self.immutable_response(response, body, self._body_hashes[flask.request.path])
+
+        return response
+
+
+if __name__ == '__main__':
+    os.environ['REFRESH_INTERVAL'] = '0'
+    os.environ['LOAD_DATASET'] = '0'
+    import app
+    # the bundles dash registers don't depend on the layout, which would need
+    # the data
+    app.app.layout = app.dash.html.Div()
+    app.static_assets.precompress_all()
+    print(f'Precompressed static files in {app.static_assets.cache_dir}')
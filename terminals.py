@@ -0,0 +1,44 @@
+import numpy
+import pandas
+import geopandas
+import shapely
+
+from routes import PROJECTED_CRS
+
+# ****************************************
+# terminal locations to geometries
+# ****************************************
+
+
+def terminal_coordinates(terms_df):
+    '''
+    lon and lat of every terminal as float arrays, NaN where the location
+    is unknown or out of range. The columns are converted in one go, so
+    'Unknown', 'TBD' and the like just fail to parse.
+    '''
+    lon, lat = (pandas.to_numeric(terms_df[column], errors='coerce').to_numpy(dtype=float, na_value=numpy.nan)
+                for column in ['Longitude', 'Latitude'])
+
+    unknown = ~((numpy.abs(lon)<=180) & (numpy.abs(lat)<=90))
+    lon[unknown] = numpy.nan
+    lat[unknown] = numpy.nan
+
+    return lon, lat
+
+def terminal_points(terms_df):
+    '''
+    The terminals with numeric Longitude and Latitude columns and their
+    locations as Points (geometry in EPSG:4326 and geometry_4087, None
+    where unknown), all built in a single call.
+    '''
+    lon, lat = terminal_coordinates(terms_df)
+    known = ~numpy.isnan(lon)
+
+    geometry = numpy.full(len(terms_df), None, dtype=object)
+    geometry[known] = shapely.points(lon[known], lat[known])
+
+    terms_gdf = geopandas.GeoDataFrame(terms_df.assign(Longitude=lon, Latitude=lat),
+                                       geometry=geometry, crs='EPSG:4326')
+    terms_gdf['geometry_4087'] = terms_gdf.geometry.to_crs(PROJECTED_CRS)
+
+    return terms_gdf